@@ -21,16 +21,27 @@ For example:
 <EXEC>/usr/local/bin/fllog udp --ipaddress 127.0.0.1 --port 2237</EXEC>
 
 """
+import fcntl
+import json
 import logging
 import os
+import select
+import shlex
 import socket
-from argparse import ArgumentParser
+import struct
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from collections import Counter
 from collections.abc import Mapping
+from decimal import Decimal
 from pathlib import Path
 from subprocess import Popen
 from tempfile import NamedTemporaryFile
 
-from fllog import modemap, wsjtx
+from fllog import (adifio, archive, bandplan, capture, contest, debuglog,
+                   dedupe, dxcc, fldigi_rpc, geo, merge, metrics, modemap,
+                   shmfeed, spool, stats, wsjtx)
 
 try:
   from datetime import UTC  # python 3.12 and up
@@ -45,9 +56,23 @@ logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
                     datefmt='%H:%M:%S', level=logging.INFO)
 
 TMP_PATH = '/var/tmp'
+TMP_MAX_AGE = 86400
+PENDING_FILE = 'fllog-pending.adi'
+LEADER_FILE = 'fllog.leader'
+DEBUG_FILE = '/tmp/fllog-debug.ring'
+LAUNCHER = '/usr/bin/open -b com.dogparksoftware.MacLoggerDX'
 
 IPADDR = '127.0.0.1'
 PORTNUM = 2237
+WSJTX_PORT = 2237
+UDP_CHECK = 0.1                 # Seconds to wait for an ICMP port unreachable
+
+SEND_LATENCY = metrics.Histogram('fllog_send_seconds', 'Time to hand a contact to MacLoggerDX',
+                                 ('transport', 'destination'))
+SEND_ERRORS = metrics.Counter('fllog_send_errors_total', 'Contacts not handed to MacLoggerDX',
+                              ('transport',))
+ADIF_WRITE = metrics.Histogram('fllog_adif_write_seconds',
+                               'Time to append a contact to the ADIF backup file')
 
 ADIF_VER = "3.1.0"
 PROGRAM_ID = "FLDIGI / FLLOG"
@@ -56,9 +81,11 @@ PROGRAM_ID = "FLDIGI / FLLOG"
 class ADIF(Mapping):
   # pylint: disable=too-many-public-methods
 
-  def __init__(self, data=None):
+  def __init__(self, data=None, timestamp=None):
     self.modemap = modemap.MODEMap()
     self._data = data
+    self._timestamp = timestamp
+    self.app_fields = {}
 
   def __getitem__(self, key):
     if key in self._data:
@@ -77,14 +104,20 @@ class ADIF(Mapping):
   def __str__(self):
     return '\n'.join([self.header, self.record])
 
+  def _now(self):
+    # Spooled contacts are delivered later, they carry the time they were made.
+    if self._timestamp:
+      return self._timestamp
+    return datetime.now(UTC)
+
   def _get_time(self):
     # Fldigi does weird things with the date and often likes to put a date far in the past.
-    gmtnow = datetime.now(UTC)
+    gmtnow = self._now()
     return gmtnow.strftime('%H%M%S')
 
   def _get_date(self):
     # Fldigi does weird things with the date and often likes to put a date far in the past.
-    gmtnow = datetime.now(UTC)
+    gmtnow = self._now()
     return gmtnow.strftime('%Y%m%d')
 
   @property
@@ -99,8 +132,8 @@ class ADIF(Mapping):
   @property
   def record(self):
     attrs = (
-      'call', 'mode', 'freq', 'gridsquare', 'rst_rcvd', 'rst_sent',
-      'qso_date', 'qso_date_off', 'time_on', 'time_off',
+      'call', 'mode', 'freq', 'band', 'gridsquare', 'distance', 'ant_az', 'country', 'cqz',
+      'ituz', 'cont', 'rst_rcvd', 'rst_sent', 'qso_date', 'qso_date_off', 'time_on', 'time_off',
       'serno_in', 'serno_out', 'comments'
     )
     fields = []
@@ -109,6 +142,8 @@ class ADIF(Mapping):
         fields.append(self._gen_field(attr, getattr(self, attr)))
       except KeyError as err:
         logging.debug(err)
+    for key, value in self.app_fields.items():
+      fields.append(self._gen_field(f'app_fllog_{key}', value))
     fields.append(self.eor)
     return ''.join(fields)
 
@@ -128,9 +163,58 @@ class ADIF(Mapping):
   def gridsquare(self):
     return self['FLDIGI_LOGBOOK_LOCATOR']
 
+  @property
+  def freq_hz(self):
+    return round(Decimal(self['FLDIGI_FREQUENCY']))
+
   @property
   def freq(self):
-    return str(float(self['FLDIGI_FREQUENCY']) / 1_000_000)
+    mhz, rest = divmod(self.freq_hz, 1_000_000)
+    return f"{mhz:d}.{f'{rest:06d}'.rstrip('0') or '0'}"
+
+  @property
+  def band(self):
+    name = bandplan.band(self.freq_hz)
+    if name is None:
+      raise KeyError(f'No band for {self.freq_hz} Hz')
+    return name
+
+  def _distance_bearing(self):
+    try:
+      return geo.grid_distance(self.my_gridsquare, self.gridsquare)
+    except ValueError as err:
+      raise KeyError(err) from None
+
+  @property
+  def distance(self):
+    return f'{self._distance_bearing()[0]:.0f}'
+
+  @property
+  def ant_az(self):
+    return f'{self._distance_bearing()[1]:.0f}'
+
+  def _entity(self):
+    resolver = dxcc.default_resolver()
+    entity = resolver.resolve(self.call) if resolver and self.call else None
+    if entity is None:
+      raise KeyError(f'No DXCC entity for {self.call}')
+    return entity
+
+  @property
+  def country(self):
+    return self._entity().entity
+
+  @property
+  def cqz(self):
+    return str(self._entity().cq_zone)
+
+  @property
+  def ituz(self):
+    return str(self._entity().itu_zone)
+
+  @property
+  def cont(self):
+    return self._entity().continent
 
   @property
   def tx_pwr(self):
@@ -207,35 +291,61 @@ class ADIF(Mapping):
 
   @staticmethod
   def _gen_field(label, value):
-    return f"<{label}:{len(value):d}>{value}"
+    return adifio.gen_field(label, value)
 
 
-def dump_env(env, adif):
-  debug_file = Path('/tmp/fllog.debug')
+def dump_env(env):
   try:
-    with open(debug_file, 'a+', encoding='utf-8') as fdd:
-      for key, val in sorted(env.items()):
-        val = val.replace('"', '\"')
-        fdd.write(f'export {key}="{val}"\n')
-      fdd.write("#" + "-" * 76 + "\n")
-      for line in str(adif).splitlines():
-        fdd.write(f'# {line}\n')
-      fdd.write("#" + "=" * 76 + "\n")
+    debuglog.DebugRing(DEBUG_FILE).write(env)
   except IOError as err:
     logging.error(err)
 
 
-def save_log(adif, logfile):
+def annotate_contest(adif, path):
+  """Record the contact in the contest and annotate the ADIF record with
+  the dupe, the new multipliers and the serial number sent"""
+  try:
+    band = adif.band
+  except KeyError:
+    band = ''
+  serial_rcvd, section = contest.parse_exchange(adif.serno_in)
+  serial_sent, _ = contest.parse_exchange(adif.serno_out)
+  engine = contest.Contest(path, resolver=dxcc.default_resolver())
+  note = engine.log(contest.QSO(adif.call.upper(), band, adif.mode or '', serial_rcvd,
+                                serial_sent, section=section))
+  adif.app_fields['dupe'] = 'Y' if note.dupe else 'N'
+  adif.app_fields['serial'] = str(note.serial)
+  if note.new_mults:
+    adif.app_fields['new_mult'] = ','.join(f'{kind}:{value}' for kind, value in note.new_mults)
+  if note.dupe:
+    logging.warning('Dupe: %s on %s %s', adif.call, band, adif.mode)
+  elif note.new_mults:
+    logging.info('New multiplier(s) %s with %s', adif.app_fields['new_mult'], adif.call)
+  return note
+
+
+def save_log(adif, logfile, max_size=0, max_records=0):
   write_header = False
   filename = Path(logfile).expanduser()
-  if not filename.exists():
-    write_header = True
+  with ADIF_WRITE.time(), archive.log_lock(filename):
+    if not filename.exists():
+      write_header = True
 
-  with open(filename, 'a', encoding='utf-8') as fdl:
-    if write_header:
-      fdl.write(adif.header + '\n')
-    fdl.write(adif.record)
-    fdl.write('\n')
+    with open(filename, 'a', encoding='utf-8') as fdl:
+      if write_header:
+        fdl.write(adif.header + '\n')
+      fdl.write(adif.record)
+      fdl.write('\n')
+    archive.rotate(filename, max_size, max_records)
+
+
+def check_refused(sock, timeout):
+  """Raise ConnectionRefusedError when the destination of the connected UDP
+  socket answers with an ICMP port unreachable within `timeout` seconds.
+  A datagram lost on the way, or dropped by a firewall, is not detected."""
+  readable, _, _ = select.select([sock], [], [], timeout)
+  if readable:
+    sock.recv(1)
 
 
 def send_adif_udp(adif, opts):
@@ -244,7 +354,7 @@ def send_adif_udp(adif, opts):
   packet.DateTimeOff = adif.datetime_off
   packet.DXCall = adif.call
   packet.DXGrid = adif.gridsquare
-  packet.DialFrequency = int(float(adif.freq) * 1_000_000)
+  packet.DialFrequency = adif.freq_hz
   packet.Mode = adif.mode
   packet.ReportSent = adif.rst_sent
   packet.ReportReceived = adif.rst_rcvd
@@ -252,26 +362,463 @@ def send_adif_udp(adif, opts):
   packet.Comments = adif.comments
   packet.DateTimeOn = adif.datetime_on
 
-  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-  sock.sendto(packet.raw(), (opts.ipaddress, opts.port))
+  destination = f'{opts.ipaddress}:{opts.port}'
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, \
+       SEND_LATENCY.labels('udp', destination).time():
+    try:
+      sock.connect((opts.ipaddress, opts.port))
+      sock.send(packet.raw())
+      check_refused(sock, UDP_CHECK)
+    except OSError:
+      SEND_ERRORS.labels('udp').inc()
+      raise
+  return True
+
+
+def cleanup_tmp(max_age=TMP_MAX_AGE):
+  """Remove the ADIF files handed off to MacLoggerDX more than `max_age` seconds ago"""
+  limit = time.time() - max_age
+  for tmp in Path(TMP_PATH).glob('fldigi-*.adi'):
+    try:
+      if tmp.stat().st_mtime < limit:
+        tmp.unlink()
+    except OSError as err:
+      logging.debug(err)
+
+
+def coalesce_records(records, window):
+  """Queue the records with the ones arriving during the next `window` seconds.
+  The process holding the leader lock waits for the window to close and
+  returns all the queued records. The other processes get None, as does
+  a leader finding its records already sent by the previous leader.
+  The lock is released by the kernel when the leader dies, the records
+  it left are then sent with the next contact.
+  """
+  pending = Path(TMP_PATH, PENDING_FILE)
+  queue_lock = Path(TMP_PATH, 'fllog.lock')
+  with spool.file_lock(queue_lock):
+    with open(pending, 'a', encoding='utf-8') as fdp:
+      fdp.write(records)
+
+  with open(Path(TMP_PATH, LEADER_FILE), 'a', encoding='utf-8') as fdl:
+    try:
+      fcntl.flock(fdl, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      return None
+    time.sleep(window)
+    with spool.file_lock(queue_lock):
+      try:
+        records = pending.read_text(encoding='utf-8')
+        pending.unlink()
+      except FileNotFoundError:
+        # Queued before the previous leader read the pending file
+        records = None
+      # Released under the queue lock, the next record queued finds no leader
+      fcntl.flock(fdl, fcntl.LOCK_UN)
+  return records
+
+
+def write_adif_file(records):
+  with NamedTemporaryFile(mode='w', dir=TMP_PATH, prefix='fldigi-', suffix='.adi',
+                          encoding='utf-8', delete=False) as temp:
+    temp.write(ADIF({}).header + '\n')
+    temp.write(records)
+  return temp.name
+
+
+def launch(launcher, filename):
+  cmd = shlex.split(launcher) + [filename]
+  with Popen(cmd, shell=False) as proc:
+    if proc.wait():
+      raise IOError(f'{cmd[0]} exit code: {proc.returncode}')
+
+
+def send_adif_pipe(adif, opts):
+  """Return True when the contact has been handed off to the launcher"""
+  cleanup_tmp()
+  records = adif.record + '\n'
+  try:
+    if opts.window > 0:
+      records = coalesce_records(records, opts.window)
+      if records is None:
+        logging.info('Contact with `%s` queued', adif.who())
+        return False
+    with SEND_LATENCY.labels('pipe', opts.launcher).time():
+      launch(opts.launcher, write_adif_file(records))
+  except IOError as err:
+    SEND_ERRORS.labels('pipe').inc()
+    logging.error(err)
+    return False
+  return True
+
+
+def spool_adif(adif, opts):
+  entry = {
+    'timestamp': adif.datetime_on.replace(tzinfo=UTC).timestamp(),
+    'transport': opts.transport,
+    'opts': {'ipaddress': getattr(opts, 'ipaddress', IPADDR),
+             'port': getattr(opts, 'port', PORTNUM),
+             'launcher': getattr(opts, 'launcher', LAUNCHER)},
+    'env': dict(adif),
+  }
+  spool.Spool(opts.spool).append(entry)
+
+
+def deliver_spooled(entries):
+  """Send the spooled contacts. The contacts for MacLoggerDX using the pipe
+  transport are handed off together in a single ADIF file"""
+  records = []
+  launcher = LAUNCHER
+  for entry in entries:
+    adif = ADIF(entry['env'], datetime.fromtimestamp(entry['timestamp'], UTC))
+    opts = Namespace(**entry['opts'])
+    if entry['transport'] == 'pipe':
+      records.append(adif.record + '\n')
+      # Entries spooled before the pipe transport could be spooled have no launcher
+      launcher = getattr(opts, 'launcher', LAUNCHER)
+    else:
+      send_adif_udp(adif, opts)
+    logging.info('Contact with `%s` delivered', adif.who())
+  if records:
+    cleanup_tmp()
+    launch(launcher, write_adif_file(''.join(records)))
+
+
+def drain_spool(opts):
+  if not opts.spool:
+    raise SystemExit('The spool directory (--spool) is required')
+  spooled = spool.Spool(opts.spool)
+  metrics.Gauge('fllog_spool_pending_bytes', 'Bytes waiting in the spool').set_function(
+    spooled.pending)
+  drainer = spool.Drainer(spooled, deliver_spooled, batch_size=opts.batch,
+                          interval=opts.interval)
+  drainer.start()
+  try:
+    drainer.join()
+  except KeyboardInterrupt:
+    drainer.stop()
 
 
-def send_adif_pipe(adif, _):
+def ingest_xmlrpc(opts):
+  opts.func = {'pipe': send_adif_pipe, 'udp': send_adif_udp}[opts.transport]
+  opts.window = 0
+  poller = fldigi_rpc.FldigiPoller(opts.url, opts.interval, opts.logbook)
+  logging.info('Watching the fldigi logbook %s', poller.logbook)
+  try:
+    poller.run(lambda env, when: log_contact(env, opts, when))
+  except KeyboardInterrupt:
+    poller.stop()
+
+
+def capture_packets(opts):
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, \
+       capture.CaptureWriter(opts.file) as writer:
+    sock.bind((opts.bind, opts.port))
+    logging.info('Capturing WSJT-X packets on %s:%d into %s', opts.bind, opts.port, opts.file)
+    try:
+      while not opts.count or len(writer) < opts.count:
+        data, _ = sock.recvfrom(capture.MAX_DATAGRAM)
+        writer.write(data)
+    except KeyboardInterrupt:
+      pass
+    logging.info('%d packets captured', len(writer))
+
+
+def publish_feed(opts):
+  decoder = wsjtx.Decoder(wsjtx.PacketType.DECODE)
+  status_filter = wsjtx.StatusFilter()
+  decodes = dedupe.DecodeDedupe()
   try:
-    with NamedTemporaryFile(mode='w', dir=TMP_PATH, prefix='fldigi-', suffix='.adi',
-                            encoding='utf-8', delete=False) as temp:
-      temp.write(str(adif))
-      temp.write('\n')
+    writer = shmfeed.FeedWriter(opts.name, opts.slots)
   except IOError as err:
-    logging.error(err)
+    raise SystemExit(err) from None
+  with writer, socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+    sock.bind((opts.bind, opts.port))
+    logging.info('Publishing the WSJT-X packets from %s:%d into %s', opts.bind, opts.port,
+                 opts.name)
+    try:
+      while True:
+        data, _ = sock.recvfrom(capture.MAX_DATAGRAM)
+        try:
+          pkt_type = wsjtx.peek_header(data)
+          if pkt_type == wsjtx.PacketType.STATUS.value:
+            wsjtx.count_packet(pkt_type)
+            result = status_filter.check(data)
+            packet = result[0] if result else None
+          elif pkt_type == wsjtx.PacketType.DECODE.value and decodes.seen(data):
+            # The decodes repeated by several clients are not decoded again
+            wsjtx.count_packet(pkt_type)
+            packet = None
+          else:
+            packet = decoder.decode(data)
+        except (IOError, NotImplementedError, struct.error, KeyError, UnicodeDecodeError,
+                ValueError) as err:
+          logging.debug(err)
+          continue
+        if packet is not None:
+          writer.publish(packet)
+    except KeyboardInterrupt:
+      pass
+
+
+def read_feed(opts):
+  with shmfeed.FeedReader(opts.name, opts.oldest) as reader:
+    try:
+      for record in reader.follow():
+        print(f'{record.seq:d} {record!r}')
+    except KeyboardInterrupt:
+      pass
+    if reader.lost:
+      logging.warning('%d record(s) lost in %d overrun(s)', reader.lost, reader.overruns)
+
+
+def replay_capture(opts):
+  if opts.decode:
+    total = Counter()
+    for lines, counter in capture.decode(opts.file, opts.workers):
+      total.update(counter)
+      if opts.verbose:
+        print('\n'.join(lines))
+    for name, count in sorted(total.items()):
+      print(f'{name:<24} {count:d}')
     return
 
+  speed = None if opts.speed == 'max' else float(opts.speed)
+  with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, \
+       capture.CaptureReader(opts.file) as reader:
+    logging.info('Replaying %d packets to %s:%d', len(reader), opts.ipaddress, opts.port)
+    capture.replay(reader, sock, (opts.ipaddress, opts.port), speed)
+
+
+def convert_log(opts):
+  formats = {'.adi': 'adif', '.adif': 'adif', '.csv': 'csv', '.json': 'jsonl', '.jsonl': 'jsonl'}
+  in_fmt = formats.get(Path(opts.input).suffix.lower(), 'adif')
+  out_fmt = opts.format or formats.get(Path(opts.output).suffix.lower())
+  if not out_fmt:
+    raise SystemExit('Unknown output format, use --format')
+
+  if in_fmt == 'adif' and out_fmt != 'adif':
+    adifio.adif_to(opts.input, opts.output, out_fmt, fields=opts.fields, workers=opts.workers)
+  elif in_fmt != 'adif' and out_fmt == 'adif':
+    adifio.to_adif(opts.input, opts.output, ADIF({}).header, in_fmt)
+  else:
+    raise SystemExit(f'Cannot convert {in_fmt} to {out_fmt}')
+  logging.info('%s converted into %s', opts.input, opts.output)
+
+
+def merge_logs(opts):
+  count = merge.merge_logs(opts.input, opts.output, ADIF({}).header, dedupe_key=opts.key,
+                           tolerance=opts.tolerance, memory=opts.memory << 20,
+                           tmpdir=opts.tmpdir)
+  logging.info('%d contacts written into %s', count, opts.output)
+
+
+def extract_log(opts):
+  count = 0
+  with open(opts.output or sys.stdout.fileno(), 'w', encoding='utf-8',
+            closefd=bool(opts.output)) as fdo:
+    fdo.write(ADIF({}).header + '\n')
+    for record in archive.read_range(opts.logfile, opts.start, opts.end):
+      fdo.write(adifio.gen_record(record) + '\n')
+      count += 1
+  logging.info('%d contact(s) extracted', count)
+
+
+def log_stats(opts):
+  logstats = stats.LogStats(opts.logfile)
+  count = logstats.update()
+  logging.info('%d new contact(s) processed', count)
+  report = logstats.report()
+  if opts.json:
+    print(json.dumps(report, indent=2))
+    return
+  print(f"Contacts: {report['total']:d}  Unique calls: ~{report['unique_calls']:d}")
+  print(f"First: {report['first']}  Last: {report['last']}")
+  for name in ('band', 'mode', 'dxcc', 'day'):
+    print(f'\n{name.upper()}')
+    for key, count in report[name].items():
+      print(f'  {key or "-":<12} {count:d}')
+
+
+def contest_summary(opts):
+  engine = contest.Contest(opts.path)
+  if opts.snapshot:
+    with engine.lock():
+      engine.snapshot()
+  summary = engine.summary()
+  if opts.json:
+    print(json.dumps(summary, indent=2))
+    return
+  print(f"Contacts: {summary['qsos']:d}  Dupes: {summary['dupes']:d}  "
+        f"Last serial: {summary['serial']:d}")
+  print(f"Multipliers: {summary['total_multipliers']:d}")
+  for kind, count in summary['multipliers'].items():
+    print(f'  {kind:<12} {count:d}')
+
+
+def debug_dump(opts):
   try:
-    cmd = ['/usr/bin/open', '-b', 'com.dogparksoftware.MacLoggerDX', temp.name]
-    with Popen(cmd, shell=False) as proc:
-      proc.wait()
-  except IOError as err:
-    logging.error(err)
+    entries = list(debuglog.DebugRing(opts.file).read())
+  except FileNotFoundError as err:
+    raise SystemExit(err) from None
+  for seq, timestamp, entry in entries[-opts.count if opts.count else 0:]:
+    print(f'# {seq:d} {datetime.fromtimestamp(timestamp, UTC):%Y-%m-%d %H:%M:%S}')
+    for key, val in sorted(entry['set'].items()):
+      val = val.replace('"', '\\"')
+      print(f'export {key}="{val}"')
+    for key in entry.get('unset', []):
+      print(f'unset {key}')
+    for key in entry.get('truncated', []):
+      print(f'# {key} too long, not recorded')
+
+
+def resolve_calls(opts):
+  try:
+    resolver = dxcc.Resolver(opts.cty)
+  except FileNotFoundError as err:
+    raise SystemExit(err) from None
+  for call, entity in zip(opts.calls, resolver.resolve_all(opts.calls)):
+    if entity is None:
+      print(f'{call:<12} unknown')
+      continue
+    print(f'{call:<12} {entity.entity} ({entity.prefix}) CQ: {entity.cq_zone:d} '
+          f'ITU: {entity.itu_zone:d} {entity.continent}')
+
+
+def _fldigi_commands(subp):
+  """Long-running commands delivering the contacts"""
+  p_drain = subp.add_parser('drain', help='Deliver the spooled log entries')
+  p_drain.set_defaults(command=drain_spool)
+  p_drain.add_argument('-b', '--batch', type=int, default=32,
+                       help="Number of entries delivered at once [default: %(default)s]")
+  p_drain.add_argument('-I', '--interval', type=float, default=1.0,
+                       help="Seconds between spool scans [default: %(default)s]")
+
+  p_dump = subp.add_parser('debug-dump', help='Print the environment recorded with --debug')
+  p_dump.set_defaults(command=debug_dump)
+  p_dump.add_argument('file', nargs='?', default=DEBUG_FILE,
+                      help="Debug ring file [default: %(default)s]")
+  p_dump.add_argument('-n', '--count', type=int, default=0,
+                      help="Number of contacts to print [default: all]")
+
+  p_rpc = subp.add_parser('xmlrpc', help='Read the contacts from fldigi using XML-RPC')
+  p_rpc.set_defaults(command=ingest_xmlrpc)
+  p_rpc.add_argument('-u', '--url', default=fldigi_rpc.FLDIGI_URL,
+                     help="fldigi XML-RPC server [default: %(default)s]")
+  p_rpc.add_argument('-L', '--logbook', default=fldigi_rpc.LOGBOOK,
+                     help="fldigi logbook file [default: %(default)s]")
+  p_rpc.add_argument('-I', '--interval', type=float, default=1.0,
+                     help="Seconds between logbook polls [default: %(default)s]")
+  p_rpc.add_argument('-t', '--transport', choices=('pipe', 'udp'), default='pipe',
+                     help="How to send the log to Macloggerdx [default: %(default)s]")
+  p_rpc.add_argument('-i', '--ipaddress', default=IPADDR,
+                     help="Macloggerdx ip address [default: %(default)s]")
+  p_rpc.add_argument('-p', '--port', type=int, default=PORTNUM,
+                     help="Macloggerdx port number [default: %(default)s]")
+  p_rpc.add_argument('-l', '--launcher', default=LAUNCHER,
+                     help="Command receiving the ADIF file [default: %(default)s]")
+
+
+def _wsjtx_commands(subp):
+  """Commands working on the WSJT-X packets"""
+  p_capt = subp.add_parser('capture', help='Record the WSJT-X packets into a capture file')
+  p_capt.set_defaults(command=capture_packets)
+  p_capt.add_argument('file', help="Capture file")
+  p_capt.add_argument('-b', '--bind', default=IPADDR,
+                      help="Address to listen to [default: %(default)s]")
+  p_capt.add_argument('-p', '--port', type=int, default=WSJTX_PORT,
+                      help="WSJT-X port number [default: %(default)s]")
+  p_capt.add_argument('-c', '--count', type=int, default=0,
+                      help="Stop after this number of packets [default: unlimited]")
+
+  p_feed = subp.add_parser('feed', help='Publish the WSJT-X decodes into shared memory')
+  p_feed.set_defaults(command=publish_feed)
+  p_feed.add_argument('-b', '--bind', default=IPADDR,
+                      help="Address to listen to [default: %(default)s]")
+  p_feed.add_argument('-p', '--port', type=int, default=WSJTX_PORT,
+                      help="WSJT-X port number [default: %(default)s]")
+  p_feed.add_argument('-n', '--name', default=shmfeed.FEED_NAME,
+                      help="Shared memory name [default: %(default)s]")
+  p_feed.add_argument('-S', '--slots', type=int, default=shmfeed.SLOTS,
+                      help="Number of records in the ring [default: %(default)s]")
+
+  p_fread = subp.add_parser('feed-read', help='Print the records of the shared memory feed')
+  p_fread.set_defaults(command=read_feed)
+  p_fread.add_argument('-n', '--name', default=shmfeed.FEED_NAME,
+                       help="Shared memory name [default: %(default)s]")
+  p_fread.add_argument('-o', '--oldest', action="store_true", default=False,
+                       help="Start with the oldest record in the ring")
+
+  p_repl = subp.add_parser('replay-capture', help='Replay or decode a capture file')
+  p_repl.set_defaults(command=replay_capture)
+  p_repl.add_argument('file', help="Capture file")
+  p_repl.add_argument('-s', '--speed', default='1', choices=('1', '10', 'max'),
+                      help="Replay speed [default: %(default)s]")
+  p_repl.add_argument('-i', '--ipaddress', default=IPADDR,
+                      help="Destination ip address [default: %(default)s]")
+  p_repl.add_argument('-p', '--port', type=int, default=WSJTX_PORT,
+                      help="Destination port number [default: %(default)s]")
+  p_repl.add_argument('-D', '--decode', action="store_true", default=False,
+                      help="Decode the capture instead of replaying it")
+  p_repl.add_argument('-v', '--verbose', action="store_true", default=False,
+                      help="Print every decoded packet")
+  p_repl.add_argument('-w', '--workers', type=int,
+                      help="Number of decoding processes [default: number of cpu]")
+
+
+def _log_commands(subp):
+  """Commands working on the ADIF log files"""
+  p_conv = subp.add_parser('convert', help='Convert ADIF from or to JSON Lines or CSV')
+  p_conv.set_defaults(command=convert_log)
+  p_conv.add_argument('input', help="Input file (.adi, .adif, .jsonl, .json or .csv)")
+  p_conv.add_argument('output', help="Output file")
+  p_conv.add_argument('-f', '--format', choices=('adif', 'jsonl', 'csv'),
+                      help="Output format [default: from the output file extension]")
+  p_conv.add_argument('-F', '--fields', type=lambda x: x.lower().split(','),
+                      help="Comma separated CSV columns [default: all the fields]")
+  p_conv.add_argument('-w', '--workers', type=int,
+                      help="Number of parsing processes [default: number of cpu]")
+
+  p_merge = subp.add_parser('merge', help='Merge and dedupe several ADIF logs')
+  p_merge.set_defaults(command=merge_logs)
+  p_merge.add_argument('input', nargs='+', help="ADIF files to merge")
+  p_merge.add_argument('-o', '--output', required=True, help="Merged ADIF file")
+  p_merge.add_argument('-k', '--key', type=lambda x: tuple(x.lower().split(',')),
+                       default=merge.DEDUPE_KEY,
+                       help="Comma separated dedupe key [default: %(default)s]")
+  p_merge.add_argument('-t', '--tolerance', type=int, default=merge.TOLERANCE,
+                       help="Seconds between the duplicates of a contact [default: %(default)s]")
+  p_merge.add_argument('-m', '--memory', type=int, default=merge.MEMORY >> 20,
+                       help="Memory used to sort, in MB [default: %(default)s]")
+  p_merge.add_argument('-T', '--tmpdir',
+                       help="Directory for the temporary files [default: system temp]")
+
+  p_extr = subp.add_parser('extract', help='Extract a date range from the log and its archives')
+  p_extr.set_defaults(command=extract_log)
+  p_extr.add_argument('logfile', help="ADIF log file")
+  p_extr.add_argument('-s', '--start', help="First QSO date YYYYMMDD[HHMMSS]")
+  p_extr.add_argument('-e', '--end', help="Last QSO date YYYYMMDD[HHMMSS]")
+  p_extr.add_argument('-o', '--output', help="ADIF output file [default: stdout]")
+
+  p_dxcc = subp.add_parser('dxcc', help='Print the DXCC entity of call signs')
+  p_dxcc.set_defaults(command=resolve_calls)
+  p_dxcc.add_argument('calls', nargs='+', type=str.upper, help="Call signs")
+  p_dxcc.add_argument('-c', '--cty', default=dxcc.CTY_FILE,
+                      help="Country file (cty.dat) [default: %(default)s]")
+
+  p_stats = subp.add_parser('stats', help='Logbook statistics')
+  p_stats.set_defaults(command=log_stats)
+  p_stats.add_argument('logfile', help="ADIF log file")
+  p_stats.add_argument('-j', '--json', action="store_true", default=False,
+                       help="JSON output")
+
+  p_cont = subp.add_parser('contest', help='Contest contacts, dupes and multipliers')
+  p_cont.set_defaults(command=contest_summary)
+  p_cont.add_argument('path', help="Contest directory")
+  p_cont.add_argument('-j', '--json', action="store_true", default=False,
+                      help="JSON output")
+  p_cont.add_argument('-S', '--snapshot', action="store_true", default=False,
+                      help="Save a snapshot and empty the journal")
 
 
 def parse_arguments():
@@ -280,19 +827,38 @@ def parse_arguments():
                           usage=__doc__)
   parser.add_argument('-a', '--adif',
                       help="Backup the log entries into an AIDF file")
+  parser.add_argument('--rotate-size', type=int, default=0,
+                      help="Archive the ADIF file above this size in KB [default: never]")
+  parser.add_argument('--rotate-records', type=int, default=0,
+                      help="Archive the ADIF file above this number of contacts [default: never]")
+  parser.add_argument('-c', '--contest',
+                      help="Track the dupes and multipliers in this contest directory")
   parser.add_argument('-d', '--debug', action="store_true", default=False,
-                      help='Dump the fldigi environment variables')
+                      help='Record the fldigi environment variables, see the debug-dump command')
+  parser.add_argument('-m', '--metrics-port', type=int, default=0,
+                      help="Serve the Prometheus metrics on localhost:port [default: off]")
+  parser.add_argument('-s', '--spool',
+                      help="Spool the log entries into this directory, see the drain command")
 
   subp = parser.add_subparsers(required=True)
   p_pipe = subp.add_parser('pipe', help='The log will be sent using a pipe command')
-  p_pipe.set_defaults(func=send_adif_pipe)
+  p_pipe.set_defaults(func=send_adif_pipe, transport='pipe')
+  p_pipe.add_argument('-w', '--window', type=float, default=0,
+                      help=("Seconds to wait for more contacts to send together "
+                            "[default: %(default)s]"))
+  p_pipe.add_argument('-l', '--launcher', default=LAUNCHER,
+                      help="Command receiving the ADIF file [default: %(default)s]")
 
   p_netw = subp.add_parser('udp', help='The log will be sent using UDP')
-  p_netw.set_defaults(func=send_adif_udp)
+  p_netw.set_defaults(func=send_adif_udp, transport='udp')
   p_netw.add_argument('-i', '--ipaddress', default=IPADDR,
                       help="Macloggerdx ip address [default: %(default)s]")
   p_netw.add_argument('-p', '--port', type=int, default=PORTNUM,
                       help="Macloggerdx port number [default: %(default)s]")
+
+  _fldigi_commands(subp)
+  _wsjtx_commands(subp)
+  _log_commands(subp)
   opts = parser.parse_args()
   return opts
 
@@ -308,22 +874,44 @@ def read_env():
   return env
 
 
-def main():
-  opts = parse_arguments()
-  env = read_env()
-
-  adif = ADIF(env)
+def log_contact(env, opts, timestamp=None):
+  adif = ADIF(env, timestamp)
   if not adif.call:
     logging.error('Logging error: No call sign')
-    raise SystemExit('No call sign')
+    return False
 
   if opts.debug:
-    dump_env(env, adif)
+    dump_env(env)
+  if opts.contest:
+    annotate_contest(adif, opts.contest)
   if opts.adif:
-    save_log(adif, opts.adif)
+    save_log(adif, opts.adif, opts.rotate_size << 10, opts.rotate_records)
+  if opts.spool:
+    spool_adif(adif, opts)
+    logging.info('Contact with `%s` spooled', adif.who())
+    return True
+
+  try:
+    sent = opts.func(adif, opts)
+  except OSError as err:
+    logging.error('Contact with `%s` not delivered: %s', adif.who(), err)
+    return True
+  if sent:
+    logging.info('Contact with `%s` logged', adif.who())
+  return True
+
 
-  opts.func(adif, opts)
-  logging.info('Contact with `%s` logged', adif.who())
+def main():
+  opts = parse_arguments()
+  if opts.metrics_port:
+    metrics.serve(opts.metrics_port)
+  if 'command' in opts:
+    opts.command(opts)
+    return
+
+  env = read_env()
+  if not log_contact(env, opts):
+    raise SystemExit('No call sign')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Read and write ADIF files, and convert them to and from JSON Lines or CSV.
+
+Large files are split on record boundaries into byte ranges. The ranges
+are parsed by a pool of processes and the results are written in order.
+"""
+
+import csv
+import io
+import json
+import mmap
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 8 << 20
+
+FIELD = re.compile(r'<([A-Za-z0-9_]+):(\d+)(?::[A-Za-z])?>|<(eor)>', re.IGNORECASE)
+EOR = re.compile(rb'<eor>', re.IGNORECASE)
+EOH = re.compile(rb'<eoh>', re.IGNORECASE)
+
+# Fields written first, in this order, in the CSV files
+STANDARD_FIELDS = (
+  'call', 'mode', 'freq', 'band', 'gridsquare', 'rst_rcvd', 'rst_sent', 'qso_date',
+  'qso_date_off', 'time_on', 'time_off', 'serno_in', 'serno_out', 'comments',
+)
+
+
+def gen_field(label, value):
+  return f"<{label}:{len(value):d}>{value}"
+
+
+def gen_record(record):
+  """Return the ADIF text of a record (a mapping of field names to values)"""
+  fields = [gen_field(key, str(val)) for key, val in record.items() if val not in (None, '')]
+  fields.append('<eor>')
+  return ''.join(fields)
+
+
+def parse_records(text):
+  """Yield the records found in the ADIF text as dictionaries. The
+  header must have been removed."""
+  record = {}
+  pos = 0
+  search = FIELD.search
+  while True:
+    match = search(text, pos)
+    if match is None:
+      break
+    name, length, eor = match.groups()
+    if eor:
+      yield record
+      record = {}
+      pos = match.end()
+      continue
+    start = match.end()
+    pos = start + int(length)
+    record[name.lower()] = text[start:pos]
+
+
+def data_start(buffer):
+  """Offset of the first record, after the header if there is one"""
+  first = EOR.search(buffer)
+  eoh = EOH.search(buffer, 0, first.start() if first else len(buffer))
+  return eoh.end() if eoh else 0
+
+
+def last_record_end(buffer, start=0):
+  """Offset following the last complete record"""
+  pos = max(buffer.rfind(b'<eor>', start), buffer.rfind(b'<EOR>', start))
+  return pos + len(b'<eor>') if pos >= 0 else start
+
+
+def split_records(buffer, chunk_size=CHUNK_SIZE, start=None, end=None):
+  """Return the (start, end) byte ranges splitting the buffer on record boundaries"""
+  start = data_start(buffer) if start is None else start
+  end = len(buffer) if end is None else end
+  ranges = []
+  while start < end:
+    match = EOR.search(buffer, start + chunk_size, end)
+    stop = match.end() if match else end
+    ranges.append((start, stop))
+    start = stop
+  return ranges
+
+
+def read_records(filename):
+  """Yield the records of an ADIF file"""
+  with open(filename, 'rb') as fda:
+    if os.fstat(fda.fileno()).st_size == 0:
+      return
+    with mmap.mmap(fda.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+      for start, end in split_records(buffer):
+        yield from parse_records(buffer[start:end].decode('utf-8', errors='replace'))
+
+
+def _parse_chunk(args):
+  filename, start, end, fmt, fields = args
+  with open(filename, 'rb') as fda:
+    with mmap.mmap(fda.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+      text = buffer[start:end].decode('utf-8', errors='replace')
+  records = parse_records(text)
+  if fmt == 'names':
+    names = set()
+    for record in records:
+      names.update(record)
+    return names
+  if fmt == 'csv':
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fields, extrasaction='ignore', lineterminator='\n')
+    writer.writerows(records)
+    return out.getvalue()
+  return ''.join(json.dumps(record) + '\n' for record in records)
+
+
+def _map_chunks(filename, fmt, fields, workers, chunk_size):
+  with open(filename, 'rb') as fda:
+    if os.fstat(fda.fileno()).st_size == 0:
+      return
+    with mmap.mmap(fda.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+      ranges = split_records(buffer, chunk_size)
+  chunks = [(filename, start, end, fmt, fields) for start, end in ranges]
+  with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+    yield from executor.map(_parse_chunk, chunks)
+
+
+def adif_to(filename, output, fmt='jsonl', *, fields=None, workers=None,
+            chunk_size=CHUNK_SIZE):
+  """Convert an ADIF file to JSON Lines (jsonl) or CSV (csv).
+  Without `fields`, the CSV columns are all the fields found in the file."""
+  # pylint: disable=too-many-arguments
+  if fmt == 'csv' and not fields:
+    names = set()
+    for chunk_names in _map_chunks(filename, 'names', None, workers, chunk_size):
+      names.update(chunk_names)
+    fields = [f for f in STANDARD_FIELDS if f in names]
+    fields.extend(sorted(names.difference(STANDARD_FIELDS)))
+
+  with open(output, 'w', encoding='utf-8', newline='') as fdo:
+    if fmt == 'csv':
+      csv.writer(fdo, lineterminator='\n').writerow(fields)
+    for text in _map_chunks(filename, fmt, fields, workers, chunk_size):
+      fdo.write(text)
+
+
+def to_adif(filename, output, header, fmt='jsonl'):
+  """Convert a JSON Lines (jsonl) or CSV (csv) file to ADIF"""
+  with open(filename, 'r', encoding='utf-8', newline='') as fdi, \
+       open(output, 'w', encoding='utf-8') as fdo:
+    if fmt == 'csv':
+      records = csv.DictReader(fdi)
+    else:
+      records = (json.loads(line) for line in fdi if line.strip())
+    fdo.write(header + '\n')
+    for record in records:
+      fdo.write(gen_record(record) + '\n')
@@ -0,0 +1,218 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Rotation and compressed archives of the ADIF backup log.
+
+When the active log reaches a size or a number of records, it is moved
+aside and compressed into `<logfile>.<timestamp>.gz`, with a `_<seq>`
+suffix for the archives made in the same second. The archive is a
+sequence of gzip members, each holding a range of complete records, so
+the whole file is still readable with gunzip. The block index is saved
+in `<archive>.idx`, with the compressed offset and length of every
+block, the byte range it covers in the original log and the first and
+last QSO date. A date range is read by decompressing only the blocks
+that overlap it. A log moved aside by a rotation interrupted by a crash
+is archived by the next rotation.
+"""
+
+import gzip
+import json
+import logging
+import mmap
+import os
+import time
+from pathlib import Path
+
+from fllog import adifio
+from fllog.spool import file_lock
+
+BLOCK_SIZE = 256 << 10
+
+
+def _qso_time(record):
+  return record.get('qso_date', '') + record.get('time_on', '').ljust(6, '0')
+
+
+def _in_range(records, start, end):
+  end = end.ljust(14, '9') if end else None
+  for record in records:
+    qso_time = _qso_time(record)
+    if (not start or qso_time >= start) and (not end or qso_time <= end):
+      yield record
+
+
+def _block_info(data, header):
+  if header:
+    data = data[adifio.data_start(data):]
+  times = [_qso_time(r) for r in adifio.parse_records(data.decode('utf-8', 'replace'))]
+  return {'first': min(times, default=None), 'last': max(times, default=None),
+          'count': len(times)}
+
+
+def log_lock(logfile):
+  """Lock held while appending to the log file or rotating it"""
+  logfile = Path(logfile).expanduser()
+  return file_lock(logfile.with_name(logfile.name + '.lock'))
+
+
+def count_records(filename):
+  with open(filename, 'rb') as fdl:
+    if os.fstat(fdl.fileno()).st_size == 0:
+      return 0
+    with mmap.mmap(fdl.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+      return len(adifio.EOR.findall(buffer))
+
+
+class Archive:
+
+  def __init__(self, filename):
+    self.filename = Path(filename)
+    with open(self.index_file(self.filename), 'r', encoding='utf-8') as fdi:
+      index = json.load(fdi)
+    self.inode = index['inode']
+    self.size = index['size']
+    self.blocks = index['blocks']
+
+  @staticmethod
+  def index_file(filename):
+    return Path(filename).with_name(Path(filename).name + '.idx')
+
+  @classmethod
+  def create(cls, source, filename, block_size=BLOCK_SIZE):
+    """Compress the ADIF file `source` into the archive `filename`"""
+    blocks = []
+    with open(source, 'rb') as fds, open(filename, 'xb') as fdo:
+      stat = os.fstat(fds.fileno())
+      if stat.st_size:
+        with mmap.mmap(fds.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+          for start, end in adifio.split_records(buffer, block_size, start=0):
+            block = _block_info(buffer[start:end], start == 0)
+            block.update(offset=fdo.tell(), start=start, end=end)
+            fdo.write(gzip.compress(buffer[start:end], mtime=0))
+            block['length'] = fdo.tell() - block['offset']
+            blocks.append(block)
+      fdo.flush()
+      os.fsync(fdo.fileno())
+    index = {'inode': stat.st_ino, 'size': stat.st_size, 'blocks': blocks}
+    tmp_file = cls.index_file(filename).with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as fdi:
+      json.dump(index, fdi)
+    os.replace(tmp_file, cls.index_file(filename))
+    return cls(filename)
+
+  def __len__(self):
+    return sum(block['count'] for block in self.blocks)
+
+  def read_block(self, block):
+    with open(self.filename, 'rb') as fda:
+      fda.seek(block['offset'])
+      return gzip.decompress(fda.read(block['length']))
+
+  def read_from(self, offset):
+    """Return the content of the original log following `offset`"""
+    chunks = []
+    for block in self.blocks:
+      if block['end'] <= offset:
+        continue
+      data = self.read_block(block)
+      chunks.append(data[max(0, offset - block['start']):])
+    return b''.join(chunks)
+
+  def records(self, start=None, end=None):
+    """Yield the records with a QSO date and time between `start` and `end`
+    (YYYYMMDD[HHMMSS] strings, both included)"""
+    last = end.ljust(14, '9') if end else None
+    for block in self.blocks:
+      if not block['count']:
+        continue
+      if (start and block['last'] < start) or (last and block['first'] > last):
+        continue
+      data = self.read_block(block)
+      if block['start'] == 0:
+        data = data[adifio.data_start(data):]
+      yield from _in_range(adifio.parse_records(data.decode('utf-8', 'replace')), start, end)
+
+
+def archives(logfile):
+  """Return the archives of `logfile`, oldest first"""
+  logfile = Path(logfile).expanduser()
+  return [Archive(name) for name in sorted(logfile.parent.glob(logfile.name + '.*.gz'))
+          if Archive.index_file(name).exists()]
+
+
+def find_archive(logfile, inode):
+  """Return the archive made from the log file with this inode"""
+  for archive in reversed(archives(logfile)):
+    if archive.inode == inode:
+      return archive
+  return None
+
+
+def should_rotate(logfile, max_size=0, max_records=0):
+  try:
+    size = os.stat(logfile).st_size
+  except FileNotFoundError:
+    return False
+  if max_size and size >= max_size:
+    return True
+  return bool(max_records) and count_records(logfile) >= max_records
+
+
+def _archive_name(logfile):
+  """Return an unused archive name, the archives made in the same second
+  get a sequence number sorting after the first one"""
+  stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+  filename = logfile.with_name(f'{logfile.name}.{stamp}.gz')
+  seq = 0
+  while filename.exists():
+    seq += 1
+    filename = logfile.with_name(f'{logfile.name}.{stamp}_{seq:03d}.gz')
+  return filename
+
+
+def _archive(logfile, source):
+  filename = _archive_name(logfile)
+  archive = Archive.create(source, filename)
+  os.unlink(source)
+  logging.info('%s archived into %s', logfile, filename)
+  return archive
+
+
+def _recover(logfile, rotating):
+  """Archive the log file left aside by a rotation interrupted by a crash"""
+  stat = os.stat(rotating)
+  archive = find_archive(logfile, stat.st_ino)
+  if archive is not None and archive.size == stat.st_size:
+    # The crash happened after the archive was made
+    os.unlink(rotating)
+    return
+  logging.warning('Recovering %s from an interrupted rotation', rotating)
+  _archive(logfile, rotating)
+
+
+def rotate(logfile, max_size=0, max_records=0):
+  """Archive the log file when it is larger than `max_size` bytes or has
+  more than `max_records` records. Return the archive or None.
+  The caller holds the `log_lock`."""
+  logfile = Path(logfile).expanduser()
+  rotating = logfile.with_name(logfile.name + '.rotating')
+  if rotating.exists():
+    _recover(logfile, rotating)
+  if not should_rotate(logfile, max_size, max_records):
+    return None
+  os.replace(logfile, rotating)
+  return _archive(logfile, rotating)
+
+
+def read_range(logfile, start=None, end=None):
+  """Yield the records of the archives and the active log between `start`
+  and `end`"""
+  for archive in archives(logfile):
+    yield from archive.records(start, end)
+  logfile = Path(logfile).expanduser()
+  if logfile.exists():
+    yield from _in_range(adifio.read_records(logfile), start, end)
@@ -0,0 +1,191 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Capture file for the raw WSJT-X datagrams.
+
+File layout:
+  header    8 bytes magic
+  records   timestamp (double), length (uint16), datagram
+  index     offset (uint64), timestamp (double), packet type (uint16) per record
+  trailer   index offset (uint64), record count (uint64), 8 bytes index magic
+
+A capture interrupted before the index is written is still readable, the
+records are scanned from the beginning of the file.
+"""
+
+import logging
+import mmap
+import os
+import struct
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property
+
+from fllog import wsjtx
+
+MAGIC = b'FLCAP\x00\x01\x00'
+INDEX_MAGIC = b'FLCAPIDX'
+RECORD = struct.Struct('!dH')
+INDEX = struct.Struct('!QdH')
+TRAILER = struct.Struct('!QQ8s')
+MAX_DATAGRAM = 65535
+
+
+def _packet_type(data):
+  try:
+    return wsjtx.peek_header(data)
+  except (IOError, struct.error):
+    return 0xffff
+
+
+class CaptureWriter:
+
+  def __init__(self, filename):
+    self._fd = open(filename, 'wb')  # pylint: disable=consider-using-with
+    self._fd.write(MAGIC)
+    self._index = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_):
+    self.close()
+
+  def __len__(self):
+    return len(self._index)
+
+  def write(self, data, timestamp=None):
+    timestamp = time.time() if timestamp is None else timestamp
+    self._index.append((self._fd.tell(), timestamp, _packet_type(data)))
+    self._fd.write(RECORD.pack(timestamp, len(data)))
+    self._fd.write(data)
+
+  def close(self):
+    if self._fd.closed:
+      return
+    index_offset = self._fd.tell()
+    for entry in self._index:
+      self._fd.write(INDEX.pack(*entry))
+    self._fd.write(TRAILER.pack(index_offset, len(self._index), INDEX_MAGIC))
+    self._fd.close()
+
+
+class CaptureReader:
+
+  def __init__(self, filename):
+    self.filename = filename
+    with open(filename, 'rb') as fdc:
+      self._map = mmap.mmap(fdc.fileno(), 0, access=mmap.ACCESS_READ)
+    if self._map[:len(MAGIC)] != MAGIC:
+      raise IOError(f'{filename} is not a capture file')
+
+  @cached_property
+  def index(self):
+    return self._read_index()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_):
+    self.close()
+
+  def __len__(self):
+    return len(self.index)
+
+  def close(self):
+    self._map.close()
+
+  def _read_index(self):
+    size = len(self._map)
+    if size >= len(MAGIC) + TRAILER.size:
+      index_offset, count, magic = TRAILER.unpack_from(self._map, size - TRAILER.size)
+      if magic == INDEX_MAGIC:
+        return [INDEX.unpack_from(self._map, index_offset + n * INDEX.size)
+                for n in range(count)]
+    logging.warning('%s has no index, scanning the records', self.filename)
+    index = []
+    offset = len(MAGIC)
+    while offset + RECORD.size <= size:
+      timestamp, length = RECORD.unpack_from(self._map, offset)
+      if offset + RECORD.size + length > size:
+        break
+      start = offset + RECORD.size
+      index.append((offset, timestamp, _packet_type(self._map[start:start + length])))
+      offset = start + length
+    return index
+
+  def packet(self, offset):
+    """Return the timestamp and the datagram of the record at `offset`"""
+    timestamp, length = RECORD.unpack_from(self._map, offset)
+    start = offset + RECORD.size
+    return timestamp, self._map[start:start + length]
+
+  def packets(self, start=0, end=None):
+    for offset, *_ in self.index[start:end]:
+      yield self.packet(offset)
+
+  def end(self):
+    """Offset following the last record"""
+    if not self.index:
+      return len(MAGIC)
+    offset = self.index[-1][0]
+    _, length = RECORD.unpack_from(self._map, offset)
+    return offset + RECORD.size + length
+
+  def records(self, start, end):
+    """Read the records sequentially from offset `start` to offset `end`"""
+    offset = start
+    while offset < end:
+      timestamp, length = RECORD.unpack_from(self._map, offset)
+      offset += RECORD.size
+      yield timestamp, self._map[offset:offset + length]
+      offset += length
+
+
+def replay(reader, sock, address, speed=1.0):
+  """Send the captured datagrams to `address`. `speed` is the replay speed
+  factor, None to send the datagrams as fast as possible."""
+  origin = None
+  started = time.monotonic()
+  for timestamp, data in reader.packets():
+    if speed:
+      origin = timestamp if origin is None else origin
+      delay = (timestamp - origin) / speed - (time.monotonic() - started)
+      if delay > 0:
+        time.sleep(delay)
+    sock.sendto(data, address)
+
+
+def _decode_chunk(args):
+  filename, start, end = args
+  lines = []
+  counter = Counter()
+  with CaptureReader(filename) as reader:
+    for timestamp, data in reader.records(start, end):
+      try:
+        packet = wsjtx.ft8_decode(data)
+      except (IOError, NotImplementedError, struct.error, UnicodeDecodeError,
+              ValueError) as err:
+        counter['ERROR'] += 1
+        lines.append(f'{timestamp:.3f} ERROR {err}')
+        continue
+      counter[packet.__class__.__name__] += 1
+      lines.append(f'{timestamp:.3f} {packet!r}')
+  return lines, counter
+
+
+def decode(filename, workers=None, chunk_size=10000):
+  """Decode the capture in chunks across a pool of processes. Yield, in
+  order, the decoded lines and the number of packets per class of every
+  chunk."""
+  with CaptureReader(filename) as reader:
+    offsets = [offset for offset, *_ in reader.index[::chunk_size]]
+    offsets.append(reader.end())
+  chunks = [(filename, start, end) for start, end in zip(offsets, offsets[1:])]
+  with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+    yield from executor.map(_decode_chunk, chunks)
@@ -0,0 +1,278 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Contest dupes, multipliers and serial numbers.
+
+The contacts worked are kept in a set indexed by (call, band, mode) and
+the multipliers in a set indexed by (kind, value, band), checking a new
+contact is a dupe or a new multiplier doesn't depend on the size of the
+log. The multiplier kinds are the WPX prefix, the CQ zone and the
+section received in the exchange.
+
+The state is saved in a directory:
+  snapshot.json   the state at a journal sequence number
+  journal.jsonl   the contacts logged since the snapshot, fsync'ed
+
+Loading reads the snapshot and replays the journal, a last line
+truncated by a crash is ignored. Every `compact` contacts the snapshot
+is written again and the journal emptied.
+
+>>> contest = Contest('~/.fllog/contest', resolver=dxcc.default_resolver())
+>>> contest.log(QSO('W6BSD', '20m', 'CW'))
+Annotation(dupe=False, new_mults=(('prefix', 'W6'), ('zone', '3')), serial=1)
+"""
+
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import NamedTuple
+
+from fllog import bandplan, dxcc
+from fllog.spool import file_lock
+
+MULTS = ('prefix', 'zone', 'section')
+COMPACT = 1000
+SNAPSHOT_VERSION = 1
+
+WPX = re.compile(r'^(\d?[A-Z]+)(\d+)')
+SERIAL = re.compile(r'^\d{1,5}$')
+SECTION = re.compile(r'^[A-Z]{2,3}$')
+RST = re.compile(r'^[1-5][1-9][1-9]?$')
+
+
+class QSO(NamedTuple):
+  call: str
+  band: str
+  mode: str
+  serial_rcvd: int = 0
+  serial_sent: int = 0
+  zone: str = ''
+  section: str = ''
+
+
+class Annotation(NamedTuple):
+  dupe: bool
+  new_mults: tuple
+  serial: int
+
+
+def wpx_prefix(call):
+  """Return the WPX prefix of the call sign, None if it has none
+
+  >>> wpx_prefix('W6BSD'), wpx_prefix('W6BSD/4'), wpx_prefix('OH/W6BSD')
+  ('W6', 'W4', 'OH0')
+  """
+  parts = [p for p in call.upper().split('/') if p and p not in dxcc.PORTABLE]
+  if not parts or any(p in dxcc.NO_ENTITY for p in parts):
+    return None
+  area = None
+  if len(parts) == 1:
+    base = parts[0]
+  else:
+    short, base = sorted(parts[:2], key=len)
+    if short.isdigit():
+      area = short
+    else:
+      base = short
+  match = WPX.match(base)
+  if match is None:
+    return base + (area or '0') if base.isalpha() else None
+  return match[1] + (area or match[2])
+
+
+def parse_exchange(exchange):
+  """Return the serial number and the section of an exchange string,
+  the signal reports are skipped"""
+  serial, section = 0, ''
+  tokens = exchange.upper().split()
+  if len(tokens) > 1 and RST.match(tokens[0]):
+    tokens = tokens[1:]
+  for token in tokens:
+    if SERIAL.match(token) and not serial:
+      serial = int(token)
+    elif SECTION.match(token) and not section:
+      section = token
+  return serial, section
+
+
+def record_from_logged(packet):
+  """Return the QSO of a WSLogged packet"""
+  serial_rcvd, section = parse_exchange(packet.ExReceived or '')
+  serial_sent, _ = parse_exchange(packet.ExSent or '')
+  return QSO(packet.DXCall.upper(), bandplan.band(packet.DialFrequency) or '',
+             (packet.as_dict()['Mode'] or '').upper(), serial_rcvd, serial_sent,
+             section=section)
+
+
+class Contest:
+  """With `per_band` the multipliers count once per band, otherwise once
+  for the whole contest."""
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, path, mults=MULTS, per_band=True, compact=COMPACT, resolver=None):
+    # pylint: disable=too-many-arguments
+    self.path = Path(path).expanduser()
+    self.path.mkdir(parents=True, exist_ok=True)
+    self.mults = tuple(mults)
+    self.per_band = per_band
+    self.compact = compact
+    self.resolver = resolver
+    self._snapshot = self.path.joinpath('snapshot.json')
+    self._journal = self.path.joinpath('journal.jsonl')
+    self.worked = set()           # (call, band, mode)
+    self.multipliers = set()      # (kind, value, band)
+    self.seq = self.serial = self.qsos = self.dupes = 0
+    self._inode = None
+    self._offset = self._pending = 0
+    with self.lock():
+      self._load()
+
+  def lock(self):
+    return file_lock(self.path.joinpath('contest.lock'))
+
+  def _load(self):
+    self.worked, self.multipliers = set(), set()
+    self.seq = self.serial = self.qsos = self.dupes = 0
+    self._inode = None
+    self._offset = self._pending = 0
+    try:
+      with open(self._snapshot, 'r', encoding='utf-8') as fds:
+        data = json.load(fds)
+    except FileNotFoundError:
+      data = None
+    if data and data['version'] == SNAPSHOT_VERSION:
+      self.worked = {tuple(key) for key in data['worked']}
+      self.multipliers = {tuple(key) for key in data['multipliers']}
+      self.seq, self.serial = data['seq'], data['serial']
+      self.qsos, self.dupes = data['qsos'], data['dupes']
+    self._replay()
+
+  def _replay(self):
+    """Apply the journal entries written since the last replay"""
+    try:
+      fdj = open(self._journal, 'rb')  # pylint: disable=consider-using-with
+    except FileNotFoundError:
+      return
+    with fdj:
+      stat = os.fstat(fdj.fileno())
+      if stat.st_ino != self._inode:
+        self._inode, self._offset = stat.st_ino, 0
+      fdj.seek(self._offset)
+      for line in fdj:
+        try:
+          entry = json.loads(line)
+        except ValueError:
+          logging.warning('%s: truncated entry at %d ignored', self._journal, self._offset)
+          break
+        self._offset += len(line)
+        if entry['seq'] <= self.seq:
+          continue
+        self._apply(entry)
+        self._pending += 1
+
+  def _apply(self, entry):
+    self.seq = entry['seq']
+    self.serial = max(self.serial, entry['sent'])
+    self.qsos += 1
+    if entry['dupe']:
+      self.dupes += 1
+    self.worked.add((entry['call'], entry['band'], entry['mode']))
+    self.multipliers.update(tuple(key) for key in entry['mults'])
+
+  def _sync(self):
+    """Catch up with the contacts logged by the other processes"""
+    try:
+      stat = os.stat(self._journal)
+    except FileNotFoundError:
+      stat = None
+    if stat is not None and stat.st_ino == self._inode and stat.st_size >= self._offset:
+      self._replay()
+    else:
+      self._load()
+
+  def is_dupe(self, call, band, mode):
+    return (call.upper(), band, mode.upper()) in self.worked
+
+  def _mult_values(self, qso):
+    values = {}
+    if 'prefix' in self.mults:
+      values['prefix'] = wpx_prefix(qso.call)
+    if 'zone' in self.mults:
+      zone = qso.zone
+      if not zone and self.resolver:
+        entity = self.resolver.resolve(qso.call)
+        zone = str(entity.cq_zone) if entity else ''
+      values['zone'] = zone
+    if 'section' in self.mults:
+      values['section'] = qso.section.upper()
+    return [(kind, value) for kind, value in values.items() if value]
+
+  def log(self, qso):
+    """Record the contact and return its Annotation: dupe, new
+    multipliers (kind, value) and the serial number sent"""
+    call, mode = qso.call.upper(), qso.mode.upper()
+    with self.lock():
+      self._sync()
+      dupe = (call, qso.band, mode) in self.worked
+      mult_band = qso.band if self.per_band else ''
+      new_mults = () if dupe else tuple(
+        (kind, value) for kind, value in self._mult_values(qso)
+        if (kind, value, mult_band) not in self.multipliers
+      )
+      serial = qso.serial_sent or self.serial + 1
+      entry = {
+        'seq': self.seq + 1, 'call': call, 'band': qso.band, 'mode': mode, 'dupe': dupe,
+        'sent': serial, 'rcvd': qso.serial_rcvd,
+        'mults': [(kind, value, mult_band) for kind, value in new_mults],
+      }
+      self._append(entry)
+      self._apply(entry)
+      self._pending += 1
+      if self.compact and self._pending >= self.compact:
+        self.snapshot()
+    return Annotation(dupe, new_mults, serial)
+
+  def _append(self, entry):
+    line = (json.dumps(entry, separators=(',', ':')) + '\n').encode('utf-8')
+    with open(self._journal, 'ab') as fdj:
+      if os.fstat(fdj.fileno()).st_size > self._offset:
+        fdj.truncate(self._offset)      # Entry truncated by a crash
+      fdj.write(line)
+      fdj.flush()
+      os.fsync(fdj.fileno())
+      self._inode = os.fstat(fdj.fileno()).st_ino
+    self._offset += len(line)
+
+  def snapshot(self):
+    """Save the state and empty the journal. The caller holds the lock."""
+    data = {
+      'version': SNAPSHOT_VERSION, 'seq': self.seq, 'serial': self.serial, 'qsos': self.qsos,
+      'dupes': self.dupes, 'worked': sorted(self.worked), 'multipliers': sorted(self.multipliers),
+    }
+    tmp_file = self._snapshot.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as fds:
+      json.dump(data, fds)
+      fds.flush()
+      os.fsync(fds.fileno())
+    os.replace(tmp_file, self._snapshot)
+    # The entries left in the old journal are older than the snapshot
+    tmp_file = self._journal.with_suffix('.tmp')
+    open(tmp_file, 'wb').close()  # pylint: disable=consider-using-with
+    os.replace(tmp_file, self._journal)
+    self._inode, self._offset = os.stat(self._journal).st_ino, 0
+    self._pending = 0
+
+  def summary(self):
+    mults = {kind: 0 for kind in self.mults}
+    for kind, _, _ in self.multipliers:
+      mults[kind] = mults.get(kind, 0) + 1
+    return {
+      'qsos': self.qsos, 'dupes': self.dupes, 'serial': self.serial,
+      'multipliers': mults, 'total_multipliers': len(self.multipliers),
+    }
@@ -0,0 +1,149 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Debug ring of the fldigi environment.
+
+The ring is a file of fixed size, made of a header and `slots` slots of
+`slot_size` bytes. Entry `n` is written into slot `n % slots`, so the
+oldest entries are overwritten. Each entry is a timestamp and a JSON
+payload holding only the FLDIGI_* variables that changed since the
+previous contact. The full environment of the previous contact is kept
+in `<ring>.env`. Nothing is formatted for display until the ring is read.
+"""
+
+import json
+import mmap
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from fllog.spool import file_lock
+
+MAGIC = b'FLDBG\x00\x01\x00'
+HEADER = struct.Struct('!8sIIQ')    # magic, slot size, slots, next sequence
+SLOT = struct.Struct('!QdII')       # sequence, timestamp, payload length, crc32
+SLOT_SIZE = 1024
+SLOTS = 256
+
+
+def env_delta(previous, env):
+  """Return the variables changed and removed between the two environments"""
+  changed = {k: v for k, v in env.items() if previous.get(k) != v}
+  removed = sorted(set(previous) - set(env))
+  return changed, removed
+
+
+class DebugRing:
+
+  def __init__(self, path, slot_size=SLOT_SIZE, slots=SLOTS):
+    self.path = Path(path).expanduser()
+    self.slot_size = slot_size
+    self.slots = slots
+    self._env_file = self.path.with_name(self.path.name + '.env')
+
+  def _lock(self):
+    return file_lock(self.path.with_name(self.path.name + '.lock'))
+
+  def _open(self):
+    """Open the ring, create it or recreate it when the layout changed"""
+    fdr = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+    size = HEADER.size + self.slot_size * self.slots
+    header = os.pread(fdr, HEADER.size, 0)
+    layout = (MAGIC, self.slot_size, self.slots)
+    if len(header) < HEADER.size or HEADER.unpack(header)[:3] != layout:
+      os.ftruncate(fdr, 0)
+      os.ftruncate(fdr, size)
+      os.pwrite(fdr, HEADER.pack(MAGIC, self.slot_size, self.slots, 1), 0)
+    return fdr
+
+  def _load_env(self):
+    try:
+      with open(self._env_file, 'r', encoding='utf-8') as fde:
+        return json.load(fde)
+    except (FileNotFoundError, ValueError):
+      return {}
+
+  def _save_env(self, env):
+    tmp_file = self._env_file.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as fde:
+      json.dump(env, fde)
+    os.replace(tmp_file, self._env_file)
+
+  def _payload(self, entry):
+    """Serialize the entry, dropping whole variables, the longest values
+    first, until it fits in a slot. The names of the variables dropped
+    are listed in `truncated` while there is room for them."""
+    capacity = self.slot_size - SLOT.size
+    dropped = []
+    payload = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+    while len(payload) > capacity and (entry['set'] or entry.get('unset')):
+      if entry['set']:
+        key = max(entry['set'], key=lambda k: len(entry['set'][k]))
+        del entry['set'][key]
+        dropped.append(key)
+      else:
+        entry['unset'].pop()
+      payload = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+    if len(payload) > capacity:
+      raise ValueError(f'Slot size {self.slot_size} too small')
+    for count in range(1, len(dropped) + 1):
+      candidate = json.dumps(dict(entry, truncated=dropped[:count]),
+                             separators=(',', ':')).encode('utf-8')
+      if len(candidate) > capacity:
+        break
+      payload = candidate
+    return payload
+
+  def write(self, env, timestamp=None):
+    """Write the variables changed since the previous call"""
+    timestamp = time.time() if timestamp is None else timestamp
+    with self._lock():
+      previous = self._load_env()
+      changed, removed = env_delta(previous, env)
+      entry = {'set': changed}
+      if removed:
+        entry['unset'] = removed
+      payload = self._payload(entry)
+      fdr = self._open()
+      try:
+        _, _, _, seq = HEADER.unpack(os.pread(fdr, HEADER.size, 0))
+        offset = HEADER.size + (seq % self.slots) * self.slot_size
+        slot = SLOT.pack(seq, timestamp, len(payload), zlib.crc32(payload))
+        os.pwrite(fdr, slot + payload, offset)
+        os.pwrite(fdr, HEADER.pack(MAGIC, self.slot_size, self.slots, seq + 1), 0)
+      finally:
+        os.close(fdr)
+      # The variables left out are recorded with the next contact
+      written = dict(previous)
+      written.update(entry['set'])
+      for key in entry.get('unset', ()):
+        written.pop(key, None)
+      self._save_env(written)
+
+  def read(self):
+    return read_ring(self.path)
+
+
+def read_ring(path):
+  """Yield the entries (sequence, timestamp, entry) of the ring, oldest first"""
+  with open(path, 'rb') as fdr:
+    with mmap.mmap(fdr.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+      magic, slot_size, slots, seq = HEADER.unpack_from(buffer)
+      if magic != MAGIC:
+        raise IOError(f'{path} is not a debug ring')
+      for num in range(max(1, seq - slots), seq):
+        offset = HEADER.size + (num % slots) * slot_size
+        slot_seq, timestamp, length, crc = SLOT.unpack_from(buffer, offset)
+        payload = buffer[offset + SLOT.size:offset + SLOT.size + length]
+        if slot_seq != num or zlib.crc32(payload) != crc:
+          continue
+        try:
+          yield num, timestamp, json.loads(payload)
+        except ValueError:
+          continue
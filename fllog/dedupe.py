@@ -0,0 +1,107 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Drop the decodes already seen.
+
+A WSReplay request makes WSJT-X send its whole decode history again,
+and several receivers on the same band report the same decodes. A decode
+is identified by (client id, Time, DeltaFrequency, hash of the message),
+read from the raw packet without decoding it. The keys are kept for
+`window` seconds in buckets of `bucket` seconds. When a bucket leaves
+the window its keys are forgotten at once.
+"""
+
+import struct
+import time
+from collections import deque
+
+from fllog import wsjtx
+
+WINDOW = 3600.0
+BUCKET = 15.0                   # FT8 cycle length in seconds
+
+DECODE_HEAD = struct.Struct('!?IidI')   # New, Time, SNR, DeltaTime, DeltaFrequency
+
+
+def decode_key(pkt, per_client=True):
+  """Return the (client id, Time, DeltaFrequency, message hash) of a raw
+  WSDecode packet"""
+  offset = wsjtx.payload_offset(pkt)
+  _, dtime, _, _, dfreq = DECODE_HEAD.unpack_from(pkt, offset)
+  offset += DECODE_HEAD.size
+  mode_len, = wsjtx.INT32.unpack_from(pkt, offset)
+  offset += wsjtx.INT32.size + max(mode_len, 0)
+  msg_len, = wsjtx.INT32.unpack_from(pkt, offset)
+  offset += wsjtx.INT32.size
+  message = hash(bytes(pkt[offset:offset + max(msg_len, 0)]))
+  client = wsjtx.peek_client_id(pkt) if per_client else None
+  return (client, dtime, dfreq, message)
+
+
+def encode_replay(client_id):
+  """Raw WSReplay packet asking the client to send its decodes again"""
+  packet = wsjtx.WSReplay()
+  packet.client_id = client_id
+  return packet.raw()
+
+
+class DecodeDedupe:
+  """With `per_client` False the same decode reported by two clients is
+  only counted once."""
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, window=WINDOW, bucket=BUCKET, per_client=True, clock=time.monotonic):
+    self.window = window
+    self.bucket = bucket
+    self.per_client = per_client
+    self.clock = clock
+    self.hits = 0
+    self.misses = 0
+    self._seen = set()
+    self._buckets = deque()       # (bucket number, keys)
+
+  def __len__(self):
+    return len(self._seen)
+
+  def _expire(self, current):
+    oldest = current - int(self.window // self.bucket)
+    while self._buckets and self._buckets[0][0] < oldest:
+      _, keys = self._buckets.popleft()
+      for key in keys:
+        self._seen.discard(key)
+
+  def seen(self, pkt):
+    """Return True if the decode has been seen during the window,
+    otherwise remember it and return False"""
+    key = decode_key(pkt, self.per_client)
+    current = int(self.clock() // self.bucket)
+    self._expire(current)
+    if key in self._seen:
+      self.hits += 1
+      return True
+    self.misses += 1
+    self._seen.add(key)
+    if not self._buckets or self._buckets[-1][0] != current:
+      self._buckets.append((current, []))
+    self._buckets[-1][1].append(key)
+    return False
+
+  def filter(self, pkt):
+    """Return the decoded packet, or None if it is a duplicate"""
+    if self.seen(pkt):
+      return None
+    return wsjtx.WSDecode(pkt)
+
+  def ingest(self, packets):
+    """Yield the new decodes of a burst of raw packets, the duplicates
+    are dropped before being decoded"""
+    for pkt in packets:
+      if not self.seen(pkt):
+        yield wsjtx.WSDecode(pkt)
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'keys': len(self._seen)}
@@ -0,0 +1,201 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Resolve call signs to their DXCC entity, CQ and ITU zones and continent,
+using a country file in the `cty.dat` format (https://www.country-files.com).
+
+The prefixes are compiled into a trie, with a table of the exact calls.
+The compiled file is pickled next to the country file and reloaded as
+long as the country file doesn't change. The resolutions are cached.
+
+>>> resolver = Resolver('~/.fllog/cty.dat')
+>>> resolver.resolve('W6BSD').entity
+'United States'
+"""
+
+import logging
+import os
+import pickle
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+
+from fllog.ft8msg import parse_message
+
+CTY_FILE = '~/.fllog/cty.dat'
+CACHE_VERSION = 1
+
+# Suffixes that don't change the entity
+PORTABLE = {'P', 'M', 'QRP', 'QRPP', 'A', 'B', 'LH', 'R', 'J', 'T'}
+# Suffixes of stations outside of any entity
+NO_ENTITY = {'MM', 'AM'}
+
+OVERRIDES = re.compile(r'\((?P<cqz>\d+)\)|\[(?P<ituz>\d+)\]|<(?P<lat>[-\d.]+)/(?P<lon>[-\d.]+)>'
+                       r'|\{(?P<cont>\w+)\}|~(?P<tz>[-\d.]+)~')
+
+_VALUE = ''                     # Trie key of the entity, no call sign character is empty
+
+
+class Entity(NamedTuple):
+  entity: str
+  prefix: str
+  cq_zone: int
+  itu_zone: int
+  continent: str
+  latitude: float
+  longitude: float
+  utc_offset: float
+
+
+def _override(entity, text):
+  """Apply the zone, position, continent and time zone overrides of a prefix"""
+  changes = {}
+  for match in OVERRIDES.finditer(text):
+    if match['cqz']:
+      changes['cq_zone'] = int(match['cqz'])
+    elif match['ituz']:
+      changes['itu_zone'] = int(match['ituz'])
+    elif match['lat']:
+      changes['latitude'], changes['longitude'] = float(match['lat']), -float(match['lon'])
+    elif match['cont']:
+      changes['continent'] = match['cont']
+    elif match['tz']:
+      changes['utc_offset'] = -float(match['tz'])
+  return entity._replace(**changes) if changes else entity
+
+
+def _parse_entity(line):
+  fields = [f.strip() for f in line.split(':')]
+  if len(fields) < 8:
+    return None
+  name, cqz, ituz, cont, lat, lon, tzone, primary = fields[:8]
+  # The longitudes are positive west and the offsets positive west of GMT
+  return Entity(name, primary.lstrip('*'), int(cqz), int(ituz), cont, float(lat),
+                -float(lon), -float(tzone))
+
+
+def parse_cty(text):
+  """Parse a country file. Return the prefix trie and the exact calls table"""
+  trie = {}
+  exact = {}
+  for block in text.split(';'):
+    head, _, prefixes = block.strip().partition('\n')
+    entity = _parse_entity(head)
+    if entity is None:
+      continue
+    for prefix in prefixes.replace('\n', '').split(','):
+      prefix = prefix.strip()
+      if not prefix:
+        continue
+      call = OVERRIDES.sub('', prefix).upper()
+      value = _override(entity, prefix)
+      if call.startswith('='):
+        exact[call[1:]] = value
+        continue
+      node = trie
+      for char in call:
+        node = node.setdefault(char, {})
+      node[_VALUE] = value
+  return trie, exact
+
+
+def _base_call(call):
+  """Return the part of a call sign giving its entity, None for the
+  maritime and aeronautical mobiles"""
+  parts = [p for p in call.split('/') if p and p not in PORTABLE]
+  if not parts or any(p in NO_ENTITY for p in parts):
+    return None
+  if len(parts) == 1:
+    return parts[0]
+  prefix, base = sorted(parts[:2], key=len)
+  if prefix.isdigit():
+    # W6BSD/4: same entity, the digit only changes the call area
+    digits = [idx for idx, char in enumerate(base) if char.isdigit()]
+    return base[:digits[0]] + prefix if digits else base + prefix
+  return prefix
+
+
+class Resolver:
+
+  def __init__(self, filename=CTY_FILE, cache_size=8192):
+    self.filename = Path(filename).expanduser()
+    self.trie, self.exact = self._load()
+    self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+  def _load(self):
+    cache = self.filename.with_name(self.filename.name + '.pickle')
+    stat = os.stat(self.filename)
+    signature = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    try:
+      with open(cache, 'rb') as fdc:
+        data = pickle.load(fdc)
+      if data['signature'] == signature:
+        return data['trie'], data['exact']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+      pass
+    with open(self.filename, 'r', encoding='utf-8', errors='replace') as fdc:
+      trie, exact = parse_cty(fdc.read())
+    try:
+      tmp_file = cache.with_suffix('.tmp')
+      with open(tmp_file, 'wb') as fdc:
+        pickle.dump({'signature': signature, 'trie': trie, 'exact': exact}, fdc,
+                    pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_file, cache)
+    except OSError as err:
+      logging.debug('Cannot save %s: %s', cache, err)
+    return trie, exact
+
+  def _lookup(self, call):
+    node = self.trie
+    found = None
+    for char in call:
+      node = node.get(char)
+      if node is None:
+        break
+      found = node.get(_VALUE, found)
+    return found
+
+  def _resolve(self, call):
+    """Return the Entity of the call sign, None if it cannot be resolved"""
+    call = call.strip().upper()
+    if call in self.exact:
+      return self.exact[call]
+    base = _base_call(call)
+    if base is None:
+      return None
+    return self.exact.get(base) or self._lookup(base)
+
+  def resolve_all(self, calls):
+    """Return the entities of a list of call signs"""
+    resolve = self.resolve
+    return [resolve(call) if call else None for call in calls]
+
+  def resolve_decodes(self, decodes):
+    """Resolve the call signs of a cycle of WSDecode packets. Return a list
+    of (decode, call, Entity)"""
+    resolve = self.resolve
+    results = []
+    for decode in decodes:
+      message = parse_message(decode.Message)
+      call = message.call if message else None
+      if call and not call.startswith('<'):
+        results.append((decode, call, resolve(call)))
+    return results
+
+
+_default = {}
+
+
+def default_resolver(filename=CTY_FILE):
+  """Shared resolver of the country file, None if the file doesn't exist"""
+  if filename not in _default:
+    try:
+      _default[filename] = Resolver(filename)
+    except FileNotFoundError:
+      _default[filename] = None
+  return _default[filename]
@@ -0,0 +1,143 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Log the contacts saved in fldigi, without a macro.
+
+A contact is logged when fldigi saves it into its logbook file, with the
+<LOG> macro or the save button. Clearing the logbook fields, or typing
+another call over them, logs nothing. The poller only stats the logbook
+file, and reads the bytes appended since the last poll when it grows.
+A logbook rewritten by fldigi, after a contact is edited or deleted, is
+detected by checking the bytes before the last offset read, nothing is
+logged and the poller starts again from the end of the file.
+The fields and the QSO time come from the saved record, the modem name
+is read once per contact from fldigi's XML-RPC server.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+from xmlrpc.client import Fault, ServerProxy
+
+from fllog import adifio
+
+FLDIGI_URL = 'http://127.0.0.1:7362'
+LOGBOOK = '~/.fldigi/logs/logbook.adif'
+TAIL = 1024                     # Bytes before the offset checked for a rewrite
+
+# Logbook fields and the environment variables fldigi sets for the
+# <EXEC> macros.
+FIELDS = {
+  'call': 'FLDIGI_LOG_CALL',
+  'name': 'FLDIGI_LOG_NAME',
+  'gridsquare': 'FLDIGI_LOGBOOK_LOCATOR',
+  'rst_rcvd': 'FLDIGI_LOGBOOK_RST_IN',
+  'rst_sent': 'FLDIGI_LOGBOOK_RST_OUT',
+  'srx': 'FLDIGI_LOGBOOK_SERNO_IN',
+  'stx': 'FLDIGI_LOGBOOK_SERNO_OUT',
+  'notes': 'FLDIGI_LOGBOOK_NOTES',
+  'my_gridsquare': 'FLDIGI_MY_LOCATOR',
+  'station_callsign': 'FLDIGI_MY_CALL',
+  'tx_pwr': 'FLDIGI_LOGBOOK_TX_PWR',
+}
+
+
+def qso_time(record):
+  """Return the start of the contact, None when the date or time is invalid"""
+  try:
+    return datetime.strptime(record.get('qso_date', '') + record.get('time_on', '').ljust(6, '0'),
+                             '%Y%m%d%H%M%S').replace(tzinfo=timezone.utc)
+  except ValueError:
+    return None
+
+
+class FldigiPoller:
+
+  def __init__(self, url=FLDIGI_URL, interval=1.0, logbook=LOGBOOK):
+    self.proxy = ServerProxy(url, allow_none=True)
+    self.interval = interval
+    self.logbook = Path(logbook).expanduser()
+    self._done = threading.Event()
+    # The contacts already in the logbook are not logged again
+    self._size = self._offset = 0
+    self._tail = b''
+    try:
+      self._resync(self.logbook.read_bytes())
+    except FileNotFoundError:
+      pass
+
+  def _resync(self, buffer):
+    self._size, self._offset = len(buffer), adifio.last_record_end(buffer)
+    self._tail = buffer[max(0, self._offset - TAIL):self._offset]
+
+  def stop(self):
+    self._done.set()
+
+  def modem_name(self):
+    try:
+      return str(self.proxy.modem.get_name()).strip()
+    except (OSError, Fault) as err:
+      logging.warning('fldigi XML-RPC error: %s', err)
+      return ''
+
+  def environment(self, record):
+    """Return the fldigi environment of a logbook record"""
+    env = {key: record[field].strip() for field, key in FIELDS.items() if record.get(field)}
+    try:
+      env['FLDIGI_FREQUENCY'] = f"{Decimal(record.get('freq', '')) * 1_000_000:.0f}"
+    except InvalidOperation:
+      pass
+    mode = record.get('submode') or record.get('mode', '')
+    env['FLDIGI_MODEM_ADIF_NAME'] = mode
+    env['FLDIGI_MODEM_LONG_NAME'] = self.modem_name() or mode
+    return env
+
+  def poll(self):
+    """Return the records saved in the logbook since the last poll"""
+    try:
+      size = os.stat(self.logbook).st_size
+    except FileNotFoundError:
+      self._resync(b'')
+      return []
+    if size == self._size:
+      return []
+    with open(self.logbook, 'rb') as fdl:
+      fdl.seek(self._offset - len(self._tail))
+      buffer = fdl.read()
+      if size < self._size or not buffer.startswith(self._tail):
+        # Contacts edited or deleted in fldigi, nothing new
+        fdl.seek(0)
+        self._resync(fdl.read())
+        return []
+    buffer = buffer[len(self._tail):]
+    start = adifio.data_start(buffer) if self._offset == 0 else 0
+    end = adifio.last_record_end(buffer, start)
+    records = list(adifio.parse_records(buffer[start:end].decode('utf-8', errors='replace')))
+    self._size = self._offset + len(buffer)
+    self._offset += end
+    self._tail = (self._tail + buffer[:end])[-TAIL:]
+    return records
+
+  def run(self, callback):
+    """Call `callback` with the environment and the QSO time of every
+    contact saved in fldigi"""
+    while not self._done.is_set():
+      try:
+        records = self.poll()
+      except OSError as err:
+        logging.warning('Cannot read %s: %s', self.logbook, err)
+        self._done.wait(self.interval * 5)
+        continue
+      for record in records:
+        try:
+          callback(self.environment(record), qso_time(record))
+        except Exception:  # pylint: disable=broad-exception-caught
+          logging.exception('Cannot log the contact with %s', record.get('call'))
+      self._done.wait(self.interval)
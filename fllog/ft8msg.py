@@ -0,0 +1,100 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Parser for the FT8/FT4 messages found in the WSJT-X decode packets.
+
+>>> parse_message('CQ DX K1ABC FN42')
+FT8Message(type=<MsgType.CQ: 1>, to=None, call='K1ABC', grid='FN42', report=None,
+           modifier='DX', text='CQ DX K1ABC FN42')
+
+The same messages repeat every cycle, the results are kept in an LRU cache.
+"""
+
+import re
+from enum import Enum
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+CACHE_SIZE = 8192
+
+_CALL = r'(?:<[A-Z0-9/.]+>|[A-Z0-9/]*[0-9][A-Z0-9/]*)'
+_GRID = r'[A-R]{2}[0-9]{2}'
+
+CQ = re.compile(
+  r'^CQ(?: (?P<modifier>[A-Z]{1,4}|[0-9]{3}))? (?P<call>' + _CALL + r')(?: (?P<grid>'
+  + _GRID + r'))?$'
+)
+STANDARD = re.compile(
+  r'^(?P<to>' + _CALL + r') (?P<call>' + _CALL + r')(?: (?P<extra>\S+))?$'
+)
+GRID = re.compile(r'^' + _GRID + r'$')
+REPORT = re.compile(r'^(?P<roger>R)?(?P<report>[+-][0-9]{2})$')
+
+
+class MsgType(Enum):
+  CQ = 1
+  REPLY = 2                     # Answer to a CQ, with or without a grid
+  REPORT = 3
+  ROGER_REPORT = 4
+  RR73 = 5                      # RR73 or RRR
+  SEVENTY_THREE = 6
+  FREE_TEXT = 7
+
+
+class FT8Message(NamedTuple):
+  type: MsgType
+  to: Optional[str]
+  call: Optional[str]
+  grid: Optional[str]
+  report: Optional[int]
+  modifier: Optional[str]
+  text: str
+
+
+def _standard(match, text):
+  to, call, extra = match.group('to', 'call', 'extra')
+  if extra is None:
+    return FT8Message(MsgType.REPLY, to, call, None, None, None, text)
+  if extra in ('RR73', 'RRR'):
+    return FT8Message(MsgType.RR73, to, call, None, None, None, text)
+  if extra == '73':
+    return FT8Message(MsgType.SEVENTY_THREE, to, call, None, None, None, text)
+  if GRID.match(extra):
+    return FT8Message(MsgType.REPLY, to, call, extra, None, None, text)
+  report = REPORT.match(extra)
+  if report:
+    msg_type = MsgType.ROGER_REPORT if report.group('roger') else MsgType.REPORT
+    return FT8Message(msg_type, to, call, None, int(report.group('report')), None, text)
+  return FT8Message(MsgType.FREE_TEXT, None, None, None, None, None, text)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_message(message):
+  """Classify an FT8/FT4 message and extract the call signs, grid and report,
+  None for an empty or null message"""
+  text = ' '.join((message or '').split()).upper()
+  if not text:
+    return None
+  match = CQ.match(text)
+  if match:
+    modifier, call, grid = match.group('modifier', 'call', 'grid')
+    return FT8Message(MsgType.CQ, None, call, grid, None, modifier, text)
+  match = STANDARD.match(text)
+  if match:
+    return _standard(match, text)
+  return FT8Message(MsgType.FREE_TEXT, None, None, None, None, None, text)
+
+
+def parse_messages(messages):
+  """Parse all the messages of a cycle"""
+  return [parse_message(msg) for msg in messages]
+
+
+def parse_decodes(decodes):
+  """Parse the messages of a list of WSDecode packets.
+  Return a list of (decode, FT8Message or None) tuples"""
+  return [(decode, parse_message(decode.Message)) for decode in decodes]
@@ -0,0 +1,126 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Maidenhead grid squares, great-circle distance and bearing.
+
+>>> grid2latlon('CM87')
+(37.5, -123.0)
+>>> round(grid_distance('CM87', 'FN42')[0])
+4395
+
+The grids are converted to the center of the square and the results are
+cached, the same grids come back cycle after cycle. `distances()`
+computes the distance and bearing of a whole batch of grids at once, in
+NumPy when it is installed.
+"""
+
+import math
+import re
+from functools import lru_cache
+
+from fllog.ft8msg import parse_message
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+EARTH_RADIUS = 6371.0           # Mean radius in km
+
+GRID = re.compile(r'^[A-R]{2}(?:[0-9]{2}(?:[A-X]{2}(?:[0-9]{2})?)?)?$', re.IGNORECASE)
+
+# Size in degrees (longitude, latitude) of the field, square, subsquare and extended square
+_CELLS = ((20.0, 10.0), (2.0, 1.0), (5.0 / 60, 2.5 / 60), (0.5 / 60, 0.25 / 60))
+
+
+@lru_cache(maxsize=8192)
+def grid2latlon(grid):
+  """Return the (latitude, longitude) of the center of the grid square"""
+  if not grid or not GRID.match(grid):
+    raise ValueError(f'Invalid grid square {grid!r}')
+  grid = grid.upper()
+  lon, lat = -180.0, -90.0
+  for idx in range(0, len(grid), 2):
+    lon_size, lat_size = _CELLS[idx // 2]
+    if grid[idx].isdigit():
+      lon += int(grid[idx]) * lon_size
+      lat += int(grid[idx + 1]) * lat_size
+    else:
+      lon += (ord(grid[idx]) - ord('A')) * lon_size
+      lat += (ord(grid[idx + 1]) - ord('A')) * lat_size
+  return lat + lat_size / 2, lon + lon_size / 2
+
+
+def distance_bearing(lat1, lon1, lat2, lon2):
+  """Great-circle distance in km and initial bearing in degrees from
+  point 1 to point 2"""
+  lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+  dlon = lon2 - lon1
+  hav = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2)
+  dist = 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(hav)))
+  bearing = math.atan2(math.sin(dlon) * math.cos(lat2),
+                       math.cos(lat1) * math.sin(lat2)
+                       - math.sin(lat1) * math.cos(lat2) * math.cos(dlon))
+  return dist, math.degrees(bearing) % 360
+
+
+@lru_cache(maxsize=8192)
+def grid_distance(origin, grid):
+  """Distance in km and bearing in degrees from the grid `origin` to `grid`"""
+  return distance_bearing(*grid2latlon(origin), *grid2latlon(grid))
+
+
+def _coordinates(grids):
+  """Latitudes and longitudes of the grids, NaN for the invalid grids"""
+  lats, lons = [], []
+  for grid in grids:
+    try:
+      lat, lon = grid2latlon(grid)
+    except ValueError:
+      lat = lon = math.nan
+    lats.append(lat)
+    lons.append(lon)
+  return lats, lons
+
+
+def distances(origin, grids):
+  """Return the distances in km and the bearings in degrees from the grid
+  `origin` to each grid. With NumPy the results are two arrays, NaN for
+  the invalid grids, otherwise two lists with None for the invalid grids."""
+  if np is None:
+    results = []
+    for grid in grids:
+      try:
+        results.append(grid_distance(origin, grid))
+      except ValueError:
+        results.append((None, None))
+    return [r[0] for r in results], [r[1] for r in results]
+
+  lat1, lon1 = np.radians(grid2latlon(origin))
+  lats, lons = _coordinates(grids)
+  lat2, lon2 = np.radians(np.array(lats)), np.radians(np.array(lons))
+  dlon = lon2 - lon1
+  hav = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+  dist = 2 * EARTH_RADIUS * np.arcsin(np.minimum(1.0, np.sqrt(hav)))
+  bearing = np.arctan2(np.sin(dlon) * np.cos(lat2),
+                       np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon))
+  return dist, np.degrees(bearing) % 360
+
+
+def decode_distances(origin, decodes):
+  """Distance and bearing of the stations sending a grid in a cycle of
+  WSDecode packets. Return a list of (decode, distance, bearing)."""
+  located = []
+  grids = []
+  for decode in decodes:
+    message = parse_message(decode.Message)
+    if message and message.grid:
+      located.append(decode)
+      grids.append(message.grid)
+  dists, bearings = distances(origin, grids)
+  return list(zip(located, dists, bearings))
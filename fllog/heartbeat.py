@@ -0,0 +1,132 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Send and track WSJT-X heartbeats for many clients from a single timer wheel.
+
+The heartbeats are encoded once when a client is registered. Sending a
+heartbeat and expiring a silent remote client are both timers in the
+wheel, each tick only looks at the timers in one slot.
+
+>>> scheduler = HeartbeatScheduler(sock)
+>>> scheduler.register('CLIENT1', ('127.0.0.1', 2237))
+>>> asyncio.run(scheduler.run())
+"""
+
+import asyncio
+import logging
+import math
+import time
+
+from fllog import wsjtx
+
+HEARTBEAT_INTERVAL = 15.0
+HEARTBEAT_TIMEOUT = 45.0
+
+
+class TimerWheel:
+  """Hashed timer wheel. The timers are identified by a key, scheduling an
+  existing key replaces the previous timer."""
+
+  def __init__(self, tick=1.0, size=64, now=None):
+    self.tick = tick
+    self.slots = [{} for _ in range(size)]
+    self.current = 0
+    self.time = time.monotonic() if now is None else now
+    self._where = {}
+
+  def __len__(self):
+    return len(self._where)
+
+  def schedule(self, key, delay):
+    self.cancel(key)
+    ticks = max(1, math.ceil(delay / self.tick))
+    rounds, offset = divmod(ticks - 1, len(self.slots))
+    slot = (self.current + offset + 1) % len(self.slots)
+    self.slots[slot][key] = rounds
+    self._where[key] = slot
+
+  def cancel(self, key):
+    slot = self._where.pop(key, None)
+    if slot is not None:
+      del self.slots[slot][key]
+
+  def advance(self, now):
+    """Move the wheel up to `now` and return the keys of the expired timers"""
+    expired = []
+    while self.time + self.tick <= now:
+      self.time += self.tick
+      self.current = (self.current + 1) % len(self.slots)
+      slot = self.slots[self.current]
+      for key, rounds in list(slot.items()):
+        if rounds:
+          slot[key] = rounds - 1
+        else:
+          del slot[key]
+          del self._where[key]
+          expired.append(key)
+    return expired
+
+
+class HeartbeatScheduler:
+  """Send our heartbeats and track the remote clients heartbeats.
+  `on_timeout` is called with the client id of a silent remote client."""
+
+  def __init__(self, sock, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT,
+               on_timeout=None):
+    # pylint: disable=too-many-arguments
+    self.sock = sock
+    self.interval = interval
+    self.timeout = timeout
+    self.on_timeout = on_timeout
+    self.wheel = TimerWheel()
+    self.clients = {}
+    self.remotes = {}
+
+  def register(self, client_id, address):
+    """Send a heartbeat every interval to `address` for `client_id`"""
+    packet = wsjtx.WSHeartbeat()
+    packet.client_id = client_id
+    self.clients[client_id] = (packet.raw(), address)
+    self.wheel.schedule(('send', client_id), 0)
+
+  def unregister(self, client_id):
+    self.clients.pop(client_id, None)
+    self.wheel.cancel(('send', client_id))
+
+  def seen(self, client_id, now=None):
+    """Record a heartbeat received from a remote client"""
+    self.remotes[client_id] = time.monotonic() if now is None else now
+    self.wheel.schedule(('timeout', client_id), self.timeout)
+
+  def alive(self):
+    return set(self.remotes)
+
+  def feed(self, pkt):
+    """Record the heartbeat if `pkt` is a raw heartbeat packet"""
+    if wsjtx.peek_header(pkt) == wsjtx.PacketType.HEARTBEAT.value:
+      self.seen(wsjtx.peek_client_id(pkt))
+
+  def tick(self, now=None):
+    now = time.monotonic() if now is None else now
+    for action, client_id in self.wheel.advance(now):
+      if action == 'send':
+        raw, address = self.clients[client_id]
+        try:
+          self.sock.sendto(raw, address)
+        except OSError as err:
+          logging.warning('Heartbeat %s to %s: %s', client_id, address, err)
+        self.wheel.schedule(('send', client_id), self.interval)
+      else:
+        del self.remotes[client_id]
+        logging.info('Client %s heartbeat timeout', client_id)
+        if self.on_timeout:
+          self.on_timeout(client_id)
+
+  async def run(self):
+    while True:
+      self.tick()
+      await asyncio.sleep(self.wheel.tick)
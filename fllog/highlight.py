@@ -0,0 +1,92 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Keep the call signs highlighted in WSJT-X in sync with the colours we
+want, sending only the changes.
+
+The colours wanted are recorded per (client id, call sign). The changes
+are sent once per FT8 cycle with `tick()` or on demand with `flush()`,
+at most `max_packets` per flush, the rest waits for the next cycle. The
+encoded packets are cached, the same (call, colour) pairs come back
+cycle after cycle.
+"""
+
+import time
+from functools import lru_cache
+
+from fllog import wsjtx
+
+CYCLE = 15.0                    # FT8 cycle length in seconds
+
+
+@lru_cache(maxsize=4096)
+def encode_highlight(client_id, call, background, foreground):
+  """The colours are tuples of 16 bit components, None clears the highlight"""
+  packet = wsjtx.WSHighlightCallsign()
+  packet.client_id = client_id
+  packet.call = call
+  packet.Background = background
+  packet.Foreground = foreground
+  return packet.raw()
+
+
+class HighlightManager:
+  """`send` is called with the raw bytes of each WSHighlightCallsign packet"""
+
+  def __init__(self, send, max_packets=50, cycle=CYCLE):
+    self.send = send
+    self.max_packets = max_packets
+    self.cycle = cycle
+    self._desired = {}
+    self._sent = {}
+    self._pending = {}          # Used as an ordered set
+    self._next_cycle = 0
+
+  def highlight(self, client_id, call, background, foreground=(0, 0, 0)):
+    self._set((client_id, call), (tuple(background), tuple(foreground)))
+
+  def clear(self, client_id, call):
+    self._set((client_id, call), None)
+
+  def _set(self, key, colors):
+    if colors is None:
+      self._desired.pop(key, None)
+    else:
+      self._desired[key] = colors
+    if self._sent.get(key) == colors:
+      self._pending.pop(key, None)
+    else:
+      self._pending[key] = None
+
+  def pending(self):
+    return len(self._pending)
+
+  def flush(self):
+    """Send the pending changes. Return the number of packets sent"""
+    count = 0
+    for key in list(self._pending):
+      if count >= self.max_packets:
+        break
+      del self._pending[key]
+      client_id, call = key
+      colors = self._desired.get(key)
+      if colors is None:
+        self.send(encode_highlight(client_id, call, None, None))
+        self._sent.pop(key, None)
+      else:
+        self.send(encode_highlight(client_id, call, *colors))
+        self._sent[key] = colors
+      count += 1
+    return count
+
+  def tick(self, now=None):
+    """Flush the changes once per cycle. Return the number of packets sent"""
+    now = time.time() if now is None else now
+    if now < self._next_cycle:
+      return 0
+    self._next_cycle = (now // self.cycle + 1) * self.cycle
+    return self.flush()
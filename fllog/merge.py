@@ -0,0 +1,179 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Merge several ADIF logs into one chronologically sorted log, without
+the duplicates, using a bounded amount of memory.
+
+The records are read into runs of at most `memory` bytes. Each run is
+sorted by (qso_date, time_on, call) and written into a temporary file,
+then the runs are merged with a k-way merge. Two records are duplicates
+when they have the same values for the fields of the dedupe key, the
+call and the exchange, and their start and end times are at most
+`tolerance` seconds apart. A record is compared with the first record
+of each group of duplicates. The times HHMM and HHMM00 are the same.
+"""
+
+import heapq
+import json
+import logging
+import os
+from collections import deque
+from contextlib import ExitStack
+from datetime import datetime
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from fllog import adifio
+
+DEDUPE_KEY = ('call', 'qso_date', 'time_on', 'band', 'mode', 'rst_sent', 'rst_rcvd', 'srx',
+              'stx')
+TIME_FIELDS = ('qso_date', 'time_on')   # Compared with the tolerance
+SORT_FIELDS = ('qso_date', 'time_on', 'call')
+TOLERANCE = 60
+MEMORY = 64 << 20
+MAX_FAN_IN = 64
+RECORD_OVERHEAD = 256           # Approximate size of an empty record dict in memory
+
+
+def _time_on(record):
+  return record.get('time_on', '').ljust(6, '0')
+
+
+def _time_off(record):
+  """End of the contact in seconds of the day, None when it is missing or invalid"""
+  try:
+    dtime = datetime.strptime(record.get('time_off', '').ljust(6, '0'), '%H%M%S')
+  except ValueError:
+    return None
+  return dtime.hour * 3600 + dtime.minute * 60 + dtime.second
+
+
+def sort_key(record):
+  return (record.get('qso_date', ''), _time_on(record), record.get('call', '').upper())
+
+
+def _qso_seconds(record):
+  """Start of the contact in seconds, None when the date or time is invalid"""
+  try:
+    dtime = datetime.strptime(record.get('qso_date', '') + _time_on(record), '%Y%m%d%H%M%S')
+  except ValueError:
+    return None
+  return dtime.toordinal() * 86400 + dtime.hour * 3600 + dtime.minute * 60 + dtime.second
+
+
+def _record_size(record):
+  return RECORD_OVERHEAD + sum(len(k) + len(v) + 100 for k, v in record.items())
+
+
+def _write_run(records, tmpdir):
+  records.sort(key=sort_key)
+  with NamedTemporaryFile('w', dir=tmpdir, suffix='.run', encoding='utf-8',
+                          delete=False) as run:
+    for record in records:
+      run.write(json.dumps(record) + '\n')
+  return run.name
+
+
+def _read_run(fdr):
+  for line in fdr:
+    yield json.loads(line)
+
+
+def _merge_runs(runs):
+  """Return an iterator over the merged runs, and the files to close"""
+  stack = ExitStack()
+  files = [stack.enter_context(open(run, encoding='utf-8')) for run in runs]
+  return heapq.merge(*[_read_run(fdr) for fdr in files], key=sort_key), stack
+
+
+def _reduce_runs(runs, tmpdir):
+  """Merge the runs until there are no more than MAX_FAN_IN of them"""
+  while len(runs) > MAX_FAN_IN:
+    merged = []
+    for idx in range(0, len(runs), MAX_FAN_IN):
+      group = runs[idx:idx + MAX_FAN_IN]
+      records, stack = _merge_runs(group)
+      with stack, NamedTemporaryFile('w', dir=tmpdir, suffix='.run', encoding='utf-8',
+                                     delete=False) as run:
+        for record in records:
+          run.write(json.dumps(record) + '\n')
+      for old in group:
+        os.unlink(old)
+      merged.append(run.name)
+    runs = merged
+  return runs
+
+
+def _same_end(first, second, tolerance):
+  if first is None or second is None:
+    return True
+  delta = abs(first - second)
+  return min(delta, 86400 - delta) <= tolerance
+
+
+def _dedupe(records, dedupe_key, tolerance=TOLERANCE):
+  """The records come sorted by time, the first record of the groups of
+  duplicates started during the last `tolerance` seconds are kept in a
+  window"""
+  fields = [field for field in dedupe_key if field not in TIME_FIELDS]
+  window = deque()              # (seconds, key, group)
+  groups = {}                   # key: [(seconds, time off)] of the groups in the window
+  dupes = 0
+  for record in records:
+    key = tuple(record.get(field, '').upper() for field in fields)
+    seconds = _qso_seconds(record)
+    if seconds is None:
+      # Without a valid time, only the identical date and time are duplicates
+      key += sort_key(record)[:2]
+      seconds = 0
+    time_off = _time_off(record)
+    while window and window[0][0] < seconds - tolerance:
+      _, old_key, old_group = window.popleft()
+      groups[old_key].remove(old_group)
+      if not groups[old_key]:
+        del groups[old_key]
+    if any(seconds - start <= tolerance and _same_end(end, time_off, tolerance)
+           for start, end in groups.get(key, ())):
+      dupes += 1
+      continue
+    group = (seconds, time_off)
+    groups.setdefault(key, []).append(group)
+    window.append((seconds, key, group))
+    yield record
+  logging.info('%d duplicate(s) removed', dupes)
+
+
+def _sorted_runs(filenames, memory, tmpdir):
+  runs = []
+  batch = []
+  used = 0
+  for filename in filenames:
+    for record in adifio.read_records(filename):
+      batch.append(record)
+      used += _record_size(record)
+      if used >= memory:
+        runs.append(_write_run(batch, tmpdir))
+        batch, used = [], 0
+  if batch:
+    runs.append(_write_run(batch, tmpdir))
+  logging.info('%d sorted run(s)', len(runs))
+  return runs
+
+
+def merge_logs(filenames, output, header, *, dedupe_key=DEDUPE_KEY, tolerance=TOLERANCE,
+               memory=MEMORY, tmpdir=None):
+  """Merge the ADIF files into `output`. Return the number of records written"""
+  # pylint: disable=too-many-arguments
+  count = 0
+  with TemporaryDirectory(dir=tmpdir, prefix='fllog-merge-') as workdir:
+    runs = _sorted_runs(filenames, memory, workdir)
+    records, stack = _merge_runs(_reduce_runs(runs, workdir))
+    with stack, open(output, 'w', encoding='utf-8') as fdo:
+      fdo.write(header + '\n')
+      for record in _dedupe(records, dedupe_key, tolerance):
+        fdo.write(adifio.gen_record(record) + '\n')
+        count += 1
+  return count
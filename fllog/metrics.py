@@ -0,0 +1,285 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+In-process metrics, served in the Prometheus text format.
+
+The metrics are declared once at the module level. A metric with labels
+keeps a child per label values. Get the child once with `labels()` and
+keep it, updating a child only takes a lock and an addition. Nothing is
+formatted until the endpoint is scraped.
+
+>>> PACKETS = Counter('fllog_packets_total', 'Packets received', ('type',))
+>>> PACKETS.labels('DECODE').inc()
+>>> serve(9120)     # http://127.0.0.1:9120/metrics
+"""
+
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Histogram buckets upper bounds, in seconds
+LATENCY_BUCKETS = (
+  0.00005, 0.0001, 0.0002, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+  1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value):
+  return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value):
+  if math.isinf(value):
+    return '+Inf' if value > 0 else '-Inf'
+  if isinstance(value, float) and value.is_integer():
+    return str(int(value))
+  return repr(value)
+
+
+def _label_text(names, values, extra=None):
+  pairs = [f'{name}="{_escape(val)}"' for name, val in zip(names, values)]
+  if extra:
+    pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+  return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Registry:
+
+  def __init__(self):
+    self._metrics = {}
+    self._lock = threading.Lock()
+
+  def register(self, metric):
+    with self._lock:
+      if metric.name in self._metrics:
+        raise ValueError(f'Metric {metric.name} already registered')
+      self._metrics[metric.name] = metric
+
+  def get(self, name):
+    return self._metrics.get(name)
+
+  def generate(self):
+    """Return all the metrics in the Prometheus text format"""
+    lines = []
+    with self._lock:
+      metrics = list(self._metrics.values())
+    for metric in metrics:
+      lines.append(f'# HELP {metric.name} {metric.documentation}')
+      lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+      lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+  TYPE = 'untyped'
+
+  def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._children = {}
+    self._lock = threading.Lock()
+    if registry is not None:
+      registry.register(self)
+
+  def _new_child(self):
+    raise NotImplementedError
+
+  def labels(self, *values):
+    """Return the child metric of these label values"""
+    values = tuple(str(v) for v in values)
+    try:
+      return self._children[values]
+    except KeyError:
+      pass
+    if len(values) != len(self.labelnames):
+      raise ValueError(f'{self.name} expects the labels {self.labelnames}')
+    with self._lock:
+      return self._children.setdefault(values, self._new_child())
+
+  def _default(self):
+    if self.labelnames:
+      raise ValueError(f'{self.name} has labels, use labels()')
+    return self.labels()
+
+  def samples(self):
+    with self._lock:
+      children = list(self._children.items())
+    for values, child in children:
+      yield from child.samples(self.name, self.labelnames, values)
+
+
+class _CounterChild:
+
+  def __init__(self):
+    self.value = 0
+    self._lock = threading.Lock()
+
+  def inc(self, amount=1):
+    with self._lock:
+      self.value += amount
+
+  def samples(self, name, labelnames, values):
+    yield f'{name}{_label_text(labelnames, values)} {_format_value(self.value)}'
+
+
+class Counter(_Metric):
+  TYPE = 'counter'
+
+  def _new_child(self):
+    return _CounterChild()
+
+  def inc(self, amount=1):
+    self._default().inc(amount)
+
+
+class _GaugeChild(_CounterChild):
+
+  def __init__(self):
+    super().__init__()
+    self._function = None
+
+  def dec(self, amount=1):
+    self.inc(-amount)
+
+  def set(self, value):
+    self.value = value
+
+  def set_function(self, function):
+    """The value is read from `function()` when the metrics are scraped"""
+    self._function = function
+
+  def samples(self, name, labelnames, values):
+    value = self._function() if self._function else self.value
+    yield f'{name}{_label_text(labelnames, values)} {_format_value(value)}'
+
+
+class Gauge(_Metric):
+  TYPE = 'gauge'
+
+  def _new_child(self):
+    return _GaugeChild()
+
+  def inc(self, amount=1):
+    self._default().inc(amount)
+
+  def dec(self, amount=1):
+    self._default().dec(amount)
+
+  def set(self, value):
+    self._default().set(value)
+
+  def set_function(self, function):
+    self._default().set_function(function)
+
+
+class _HistogramChild:
+
+  def __init__(self, buckets):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.total = 0.0
+    self._lock = threading.Lock()
+
+  def observe(self, value):
+    idx = bisect_left(self.buckets, value)
+    with self._lock:
+      self.counts[idx] += 1
+      self.total += value
+
+  @contextmanager
+  def time(self):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - start)
+
+  def percentile(self, pct):
+    """Return the percentile, interpolated within its bucket"""
+    with self._lock:
+      counts = list(self.counts)
+    rank = sum(counts) * pct / 100
+    seen = 0
+    for idx, count in enumerate(counts):
+      if count and seen + count >= rank:
+        low = self.buckets[idx - 1] if idx else 0.0
+        high = self.buckets[idx] if idx < len(self.buckets) else self.buckets[-1]
+        return low + (high - low) * (rank - seen) / count
+      seen += count
+    return 0.0
+
+  def summary(self):
+    return {'count': sum(self.counts), 'p50': self.percentile(50), 'p99': self.percentile(99)}
+
+  def samples(self, name, labelnames, values):
+    with self._lock:
+      counts, total = list(self.counts), self.total
+    cumulative = 0
+    for bound, count in zip(self.buckets + (math.inf,), counts):
+      cumulative += count
+      labels = _label_text(labelnames, values, ('le', _format_value(float(bound))))
+      yield f'{name}_bucket{labels} {cumulative:d}'
+    yield f'{name}_sum{_label_text(labelnames, values)} {_format_value(total)}'
+    yield f'{name}_count{_label_text(labelnames, values)} {cumulative:d}'
+
+
+class Histogram(_Metric):
+  TYPE = 'histogram'
+
+  def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS,
+               registry=REGISTRY):
+    # pylint: disable=too-many-arguments
+    self.buckets = tuple(sorted(buckets))
+    super().__init__(name, documentation, labelnames, registry)
+
+  def _new_child(self):
+    return _HistogramChild(self.buckets)
+
+  def observe(self, value):
+    self._default().observe(value)
+
+  def time(self):
+    return self._default().time()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+  registry = REGISTRY
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = self.registry.generate().encode('utf-8')
+    self.send_response(200)
+    self.send_header('Content-Type', CONTENT_TYPE)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    logging.debug(format, *args)
+
+
+def serve(port, address='127.0.0.1', registry=REGISTRY):
+  """Serve the metrics on http://address:port/metrics from a daemon thread"""
+  handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+  server = ThreadingHTTPServer((address, port), handler)
+  server.daemon_threads = True
+  thread = threading.Thread(target=server.serve_forever, name='metrics', daemon=True)
+  thread.start()
+  logging.info('Metrics served on http://%s:%d/metrics', address, port)
+  return server
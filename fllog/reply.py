@@ -0,0 +1,61 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Fast path to answer a decode with a WSReply packet.
+
+The reply carries the same Time, SNR, DeltaTime, DeltaFrequency, Mode,
+Message and LowConfidence fields as the decode, in the same order. The
+reply is built by copying these bytes from the raw decode packet, with
+no decoding and no encoding. The time between the reception of the
+decode and the reply being sent is recorded in the
+`fllog_reply_latency_seconds` histogram.
+"""
+
+import struct
+import time
+
+from fllog import metrics, wsjtx
+from fllog.wsjtx import SHEAD, PacketType
+
+UINT32 = struct.Struct('!I')
+REPLY_TYPE = UINT32.pack(PacketType.REPLY.value)
+
+# Offset of the Mode field after the client id: New, Time, SNR, DeltaTime, DeltaFrequency
+MODE_OFFSET = 1 + 4 + 4 + 8 + 4
+
+REPLY_LATENCY = metrics.Histogram('fllog_reply_latency_seconds',
+                                  'Time between the reception of a decode and its reply')
+
+
+def reply_from_decode(pkt, modifiers=wsjtx.Modifiers.NoModifier):
+  """Build the raw WSReply packet answering the raw WSDecode packet `pkt`"""
+  if wsjtx.peek_header(pkt) != PacketType.DECODE.value:
+    raise IOError('Not a WSJT-X decode packet')
+  id_end = SHEAD.size + 4 + UINT32.unpack_from(pkt, SHEAD.size)[0]
+  index = id_end + MODE_OFFSET
+  index += 4 + UINT32.unpack_from(pkt, index)[0]         # Mode
+  index += 4 + UINT32.unpack_from(pkt, index)[0]         # Message
+  index += 1                                             # LowConfidence
+  return b''.join((pkt[:8], REPLY_TYPE, pkt[SHEAD.size:id_end], pkt[id_end + 1:index],
+                   bytes((modifiers.value,))))
+
+
+class ReplySender:
+  """Send replies on a persistent socket, usually the socket the decodes
+  are received on, WSJT-X listens on the port it sends from."""
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self, sock):
+    self.sock = sock
+    self.latency = REPLY_LATENCY.labels()
+
+  def reply(self, pkt, address, received=None, modifiers=wsjtx.Modifiers.NoModifier):
+    """Answer the decode `pkt` received from `address`. `received` is the
+    time.perf_counter() value when the packet was received."""
+    self.sock.sendto(reply_from_decode(pkt, modifiers), address)
+    if received is not None:
+      self.latency.observe(time.perf_counter() - received)
@@ -0,0 +1,204 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Track the state of several WSJT-X / JTDX instances sending to the same
+logger. Each instance is identified by its client id.
+
+The packets are dispatched to a pool of worker threads, sharded by client
+id, so all the packets from one instance are processed in order by the
+same worker. Each shard has its own bounded queue, a noisy instance fills
+its own queue and doesn't hold back the instances on the other shards.
+The status packets identical to the previous one are not decoded, the
+fields changed by the last status are in `Session.status_delta`. The
+decodes already seen, replayed by WSJT-X, are dropped before decoding.
+"""
+
+import logging
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import Counter, deque
+
+from fllog import dedupe, metrics, wsjtx
+from fllog.wsjtx import PacketType
+
+HEARTBEAT_TIMEOUT = 45          # WSJT-X sends a heartbeat every 15 seconds
+LOGGED_SIZE = 256               # Contacts kept per session
+
+QUEUE_DEPTH = metrics.Gauge('fllog_session_queue_depth', 'Packets waiting in a shard queue',
+                            ('shard',))
+QUEUE_DROPPED = metrics.Counter('fllog_session_dropped_total',
+                                'Packets dropped because the shard queue was full')
+
+SUBSCRIBED = (
+  PacketType.HEARTBEAT, PacketType.STATUS, PacketType.DECODE, PacketType.CLEAR,
+  PacketType.QSOLOGGED, PacketType.CLOSE, PacketType.WSPRDECODE, PacketType.LOGGEDADIF,
+)
+
+
+class Session:
+
+  def __init__(self, client_id, ring_size=1024, logged_size=LOGGED_SIZE):
+    self.client_id = client_id
+    self.status = None
+    self.status_delta = {}
+    self.heartbeat = None
+    self.last_seen = time.monotonic()
+    self.decodes = deque(maxlen=ring_size)
+    self.logged = deque(maxlen=logged_size)
+
+  def __repr__(self):
+    return (f'<Session {self.client_id} decodes: {len(self.decodes)} '
+            f'logged: {len(self.logged)}>')
+
+  def alive(self, timeout=HEARTBEAT_TIMEOUT):
+    return time.monotonic() - self.last_seen < timeout
+
+  def touch(self):
+    self.last_seen = time.monotonic()
+
+  def update(self, packet):
+    self.touch()
+    if isinstance(packet, wsjtx.WSHeartbeat):
+      self.heartbeat = packet
+    elif isinstance(packet, wsjtx.WSStatus):
+      self.status = packet
+    elif isinstance(packet, (wsjtx.WSDecode, wsjtx.WSWSPRDecode)):
+      self.decodes.append(packet)
+    elif isinstance(packet, wsjtx.WSClear):
+      self.decodes.clear()
+    elif isinstance(packet, (wsjtx.WSLogged, wsjtx.WSADIF)):
+      self.logged.append(packet)
+
+
+class SessionManager:
+  """Keep a Session per client id.
+
+  `callback`, when set, is called from the worker threads with the
+  session and the packet after every update.
+  """
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, shards=4, ring_size=1024, queue_size=4096, callback=None,
+               dedupe_window=dedupe.WINDOW):
+    # pylint: disable=too-many-arguments
+    self.sessions = {}
+    self.ring_size = ring_size
+    self.callback = callback
+    self.dropped = Counter()
+    self._lock = threading.Lock()
+    self._queues = [queue.Queue(queue_size) for _ in range(shards)]
+    self._dedupes = [dedupe.DecodeDedupe(dedupe_window) for _ in range(shards)]
+    for shard, que in enumerate(self._queues):
+      QUEUE_DEPTH.labels(shard).set_function(que.qsize)
+    self._workers = [threading.Thread(target=self._worker, args=args, daemon=True)
+                     for args in zip(self._queues, self._dedupes)]
+
+  def start(self):
+    for worker in self._workers:
+      worker.start()
+
+  def stop(self):
+    for que in self._queues:
+      que.put(None)
+    for worker in self._workers:
+      worker.join()
+
+  def dispatch(self, pkt):
+    """Queue a raw packet on the shard of its client. Return False if the
+    packet was dropped because the shard queue is full."""
+    try:
+      client_id = wsjtx.peek_client_id(pkt) or ''
+    except struct.error:
+      client_id = ''           # Truncated packet, the worker logs it
+    shard = zlib.crc32(client_id.encode('utf-8')) % len(self._queues)
+    try:
+      self._queues[shard].put_nowait(pkt)
+    except queue.Full:
+      self.dropped[client_id] += 1
+      QUEUE_DROPPED.inc()
+      return False
+    return True
+
+  def _worker(self, que, decodes):
+    decoder = wsjtx.Decoder(*SUBSCRIBED)
+    status_filter = wsjtx.StatusFilter()
+    while True:
+      pkt = que.get()
+      if pkt is None:
+        break
+      try:
+        pkt_type = wsjtx.peek_header(pkt)
+        if pkt_type == PacketType.STATUS.value:
+          wsjtx.count_packet(pkt_type)
+          self._update_status(pkt, status_filter)
+          continue
+        if pkt_type == PacketType.DECODE.value and decodes.seen(pkt):
+          wsjtx.count_packet(pkt_type)
+          continue
+        packet = decoder.decode(pkt)
+      except (IOError, NotImplementedError, struct.error, UnicodeDecodeError, ValueError) as err:
+        logging.debug(err)
+        continue
+      except Exception:  # pylint: disable=broad-exception-caught
+        # A worker that dies drops every client of its shard
+        logging.exception('Cannot process the WSJT-X packet')
+        continue
+      try:
+        if isinstance(packet, wsjtx.WSClose):
+          status_filter.forget(packet.client_id)
+        if packet is not None:
+          self.update(packet)
+      except Exception:  # pylint: disable=broad-exception-caught
+        logging.exception('Cannot process the %s packet', packet.__class__.__name__)
+
+  def _update_status(self, pkt, status_filter):
+    """The statuses identical to the previous one are not decoded, they
+    only keep the session alive"""
+    result = status_filter.check(pkt)
+    if result is None:
+      session = self.sessions.get(wsjtx.peek_client_id(pkt))
+      if session:
+        session.touch()
+      return
+    packet, delta = result
+    self.update(packet, delta)
+
+  def update(self, packet, delta=None):
+    client_id = packet.client_id
+    if isinstance(packet, wsjtx.WSClose):
+      with self._lock:
+        session = self.sessions.pop(client_id, None)
+      logging.info('Client %s closed', client_id)
+    else:
+      session = self.sessions.get(client_id)
+      if session is None:
+        with self._lock:
+          session = self.sessions.setdefault(client_id, Session(client_id, self.ring_size))
+      session.update(packet)
+      if delta is not None:
+        session.status_delta = delta
+    if self.callback and session:
+      self.callback(session, packet)
+
+  def dedupe_stats(self):
+    """Number of duplicate decodes (hits) and new decodes (misses)"""
+    return {key: sum(d.stats()[key] for d in self._dedupes) for key in ('hits', 'misses', 'keys')}
+
+  def get(self, client_id):
+    return self.sessions.get(client_id)
+
+  def alive(self, timeout=HEARTBEAT_TIMEOUT):
+    """Return the sessions still alive. The stale sessions are removed"""
+    with self._lock:
+      for client_id, session in list(self.sessions.items()):
+        if not session.alive(timeout):
+          logging.info('Client %s timed out', client_id)
+          del self.sessions[client_id]
+      return list(self.sessions.values())
@@ -0,0 +1,274 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Shared memory feed of the WSJT-X decodes and statuses.
+
+One process receives and decodes the WSJT-X packets, and publishes them
+as fixed size records into a ring in shared memory. Any number of local
+processes read the ring without a socket and without parsing the WSJT-X
+protocol. The writer never waits for the readers.
+
+Layout:
+  header    magic, number of slots, slot size, writer pid, next sequence number
+  slots     sequence number, record kind, reception time, record
+
+The writer sets the sequence number of a slot to 0 while writing it and
+to the record sequence number once written. A reader checks the
+sequence number before and after reading a slot. A reader falling more
+than a ring behind, or reading a slot being overwritten, detects the
+overrun, counts the records lost and continues with the oldest record
+still in the ring.
+
+A writer only replaces an existing feed when the process that wrote it
+is gone, it refuses to start while that process is running.
+"""
+
+import logging
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import NamedTuple
+
+from fllog import wsjtx
+from fllog.wstime import datetime2wstime, wstime2datetime
+
+FEED_NAME = 'fllog-feed'
+MAGIC = b'FLFEED\x00\x02'
+SLOTS = 4096
+SLOT_SIZE = 192
+
+HEADER = struct.Struct('!8sIIQQ')         # magic, slots, slot size, writer pid, next sequence
+SLOT_SEQ = struct.Struct('!Q')
+SLOT_HEAD = struct.Struct('!Bd')          # kind, reception time
+# client id, time, SNR, DeltaTime, DeltaFrequency, mode, message, low confidence, off air
+DECODE = struct.Struct('!16sIidI4s64s??')
+# client id, frequency, mode, dx call, report, tx mode, tx enabled, transmitting,
+# decoding, rx df, tx df, de call, de grid, tr period, tx message
+STATUS = struct.Struct('!16sQ8s16s8s8s???II16s8sI32s')
+
+KIND_DECODE = 1
+KIND_STATUS = 2
+
+_written = set()                # Feeds written by this process
+
+
+class Decode(NamedTuple):
+  seq: int
+  received: float
+  client_id: str
+  time: object
+  snr: int
+  delta_time: float
+  delta_frequency: int
+  mode: str
+  message: str
+  low_confidence: bool
+  off_air: bool
+
+
+class Status(NamedTuple):
+  seq: int
+  received: float
+  client_id: str
+  frequency: int
+  mode: str
+  dx_call: str
+  report: str
+  tx_mode: str
+  tx_enabled: bool
+  transmitting: bool
+  decoding: bool
+  rx_df: int
+  tx_df: int
+  de_call: str
+  de_grid: str
+  tr_period: int
+  tx_message: str
+
+
+def _bytes(value):
+  return (value or '').encode('utf-8')
+
+
+def _str(value):
+  return value.rstrip(b'\x00').decode('utf-8', 'replace')
+
+
+def _pack_decode(buffer, offset, packet):
+  DECODE.pack_into(buffer, offset, _bytes(packet.client_id), datetime2wstime(packet.Time),
+                   packet.SNR, packet.DeltaTime, packet.DeltaFrequency,
+                   _bytes(packet.as_dict()['Mode']), _bytes(packet.Message),
+                   packet.LowConfidence, packet.OffAir)
+
+
+def _pack_status(buffer, offset, packet):
+  fields = packet.as_dict()
+  STATUS.pack_into(buffer, offset, _bytes(packet.client_id), fields['Frequency'],
+                   _bytes(fields['Mode']), _bytes(fields['DXCall']), _bytes(fields['Report']),
+                   _bytes(fields['TXMode']), fields['TXEnabled'], fields['Transmitting'],
+                   fields['Decoding'], fields['RXdf'], fields['TXdf'], _bytes(fields['DeCall']),
+                   _bytes(fields['DeGrid']), fields['TRPeriod'] or 0, _bytes(fields['TxMessage']))
+
+
+def _unpack(buffer, offset, seq):
+  kind, received = SLOT_HEAD.unpack_from(buffer, offset)
+  offset += SLOT_HEAD.size
+  if kind == KIND_DECODE:
+    client, dtime, snr, delta_t, delta_f, mode, message, low, off = DECODE.unpack_from(
+      buffer, offset)
+    return Decode(seq, received, _str(client), wstime2datetime(dtime), snr, delta_t, delta_f,
+                  _str(mode), _str(message), low, off)
+  values = list(STATUS.unpack_from(buffer, offset))
+  return Status(seq, received, *[_str(v) if isinstance(v, bytes) else v for v in values])
+
+
+def _is_running(pid):
+  try:
+    os.kill(pid, 0)
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass                        # Running under another user
+  return True
+
+
+def _remove_stale(name):
+  """Remove the feed left behind by a writer that didn't exit cleanly,
+  raise IOError when the feed is still written or is not a fllog feed"""
+  shm = shared_memory.SharedMemory(name)
+  try:
+    header = bytes(shm.buf[:HEADER.size])
+  finally:
+    shm.close()
+  if len(header) == HEADER.size and header.startswith(MAGIC):
+    pid = HEADER.unpack(header)[3]
+    if pid != os.getpid() and not _is_running(pid):
+      logging.warning('Removing the feed %s left by process %d', name, pid)
+      shm.unlink()
+      return
+    error = f'{name} is written by the running process {pid}'
+  elif header.startswith(MAGIC[:6]):
+    # Older layout without the writer pid
+    logging.warning('Removing the feed %s left by an older version', name)
+    shm.unlink()
+    return
+  else:
+    error = f'{name} exists and is not a fllog feed'
+  resource_tracker.unregister(shm._name, 'shared_memory')  # pylint: disable=protected-access
+  raise IOError(error)
+
+
+class FeedWriter:
+  """Publish WSDecode and WSStatus packets into the shared memory ring"""
+
+  def __init__(self, name=FEED_NAME, slots=SLOTS):
+    self.slots = slots
+    size = HEADER.size + slots * SLOT_SIZE
+    try:
+      self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+    except FileExistsError:
+      _remove_stale(name)
+      self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+    _written.add(name)
+    self.pid = os.getpid()
+    self.seq = 1
+    HEADER.pack_into(self.shm.buf, 0, MAGIC, slots, SLOT_SIZE, self.pid, self.seq)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_):
+    self.close()
+
+  def publish(self, packet, received=None):
+    """Write the packet into the next slot, return its sequence number"""
+    received = time.time() if received is None else received
+    if isinstance(packet, wsjtx.WSDecode):
+      kind, pack = KIND_DECODE, _pack_decode
+    elif isinstance(packet, wsjtx.WSStatus):
+      kind, pack = KIND_STATUS, _pack_status
+    else:
+      raise TypeError(f'Cannot publish {packet.__class__.__name__} packets')
+    buf = self.shm.buf
+    seq = self.seq
+    offset = HEADER.size + (seq % self.slots) * SLOT_SIZE
+    SLOT_SEQ.pack_into(buf, offset, 0)
+    SLOT_HEAD.pack_into(buf, offset + SLOT_SEQ.size, kind, received)
+    pack(buf, offset + SLOT_SEQ.size + SLOT_HEAD.size, packet)
+    SLOT_SEQ.pack_into(buf, offset, seq)
+    self.seq = seq + 1
+    HEADER.pack_into(buf, 0, MAGIC, self.slots, SLOT_SIZE, self.pid, self.seq)
+    return seq
+
+  def close(self, unlink=True):
+    self.shm.close()
+    if unlink:
+      self.shm.unlink()
+
+
+class FeedReader:
+  """Read the records published since the reader was opened, or the
+  records still in the ring with `oldest=True`."""
+
+  def __init__(self, name=FEED_NAME, oldest=False):
+    self.shm = shared_memory.SharedMemory(name)
+    if name not in _written:
+      # The writer owns the segment, it must not be removed when the reader exits
+      resource_tracker.unregister(self.shm._name,  # pylint: disable=protected-access
+                                  'shared_memory')
+    magic, self.slots, self.slot_size, _, head = HEADER.unpack_from(self.shm.buf)
+    if magic != MAGIC:
+      self.shm.close()
+      raise IOError(f'{name} is not a fllog feed')
+    self.next = max(1, head - self.slots + 1) if oldest else head
+    self.lost = 0
+    self.overruns = 0
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *_):
+    self.close()
+
+  def close(self):
+    self.shm.close()
+
+  def _overrun(self, head):
+    oldest = max(1, head - self.slots + 1, self.next + 1)
+    self.overruns += 1
+    self.lost += oldest - self.next
+    self.next = oldest
+
+  def read(self, max_records=None):
+    """Return the records published since the last read"""
+    buf = self.shm.buf
+    records = []
+    while max_records is None or len(records) < max_records:
+      head, = SLOT_SEQ.unpack_from(buf, HEADER.size - SLOT_SEQ.size)
+      if self.next >= head:
+        break
+      if head - self.next >= self.slots:
+        self._overrun(head)
+        continue
+      offset = HEADER.size + (self.next % self.slots) * self.slot_size
+      seq, = SLOT_SEQ.unpack_from(buf, offset)
+      record = _unpack(buf, offset + SLOT_SEQ.size, seq) if seq == self.next else None
+      if record is None or SLOT_SEQ.unpack_from(buf, offset)[0] != self.next:
+        self._overrun(SLOT_SEQ.unpack_from(buf, HEADER.size - SLOT_SEQ.size)[0])
+        continue
+      records.append(record)
+      self.next += 1
+    return records
+
+  def follow(self, interval=0.05):
+    """Yield the records as they are published"""
+    while True:
+      records = self.read()
+      if not records:
+        time.sleep(interval)
+      yield from records
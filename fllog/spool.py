@@ -0,0 +1,256 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Durable on-disk spool for QSOs that cannot be delivered right away.
+
+The spool is a directory of append-only segment files. Each entry is
+framed with a sync marker, its length and a CRC32 checksum, then
+fsync'ed. The file `ack` holds the position (segment, offset) of the
+last entry delivered. A `Drainer` thread reads the pending entries in
+batches, hands them to a delivery function and acknowledges them once
+delivered.
+
+A corrupted record is skipped up to the next sync marker starting a
+valid record, a record torn at the end of the last segment is truncated
+before the next append. The entries that cannot be delivered, whatever
+the retries, are moved to the file `quarantine.jsonl`.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from pathlib import Path
+
+SEGMENT_SIZE = 1 << 20
+SYNC = b'\xf5SPL'
+RECORD = struct.Struct('!4sII')   # sync marker, payload length, crc32
+QUARANTINE = 'quarantine.jsonl'
+
+
+@contextmanager
+def file_lock(filename):
+  """Exclusive lock shared by every process using `filename`"""
+  with open(filename, 'a', encoding='utf-8') as fdl:
+    fcntl.flock(fdl, fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(fdl, fcntl.LOCK_UN)
+
+
+def _unpack_record(data, offset):
+  """Return (end offset, entry) of the record at `offset`, None when the
+  record is torn or corrupted"""
+  if offset + RECORD.size > len(data):
+    return None
+  sync, length, crc = RECORD.unpack_from(data, offset)
+  if sync != SYNC:
+    return None
+  start = offset + RECORD.size
+  payload = data[start:start + length]
+  if len(payload) < length or zlib.crc32(payload) != crc:
+    return None
+  try:
+    return start + length, json.loads(payload)
+  except ValueError:
+    return None
+
+
+def _resync(data, offset):
+  """Return the offset of the next valid record after `offset`, None if there is none"""
+  pos = data.find(SYNC, offset + 1)
+  while pos != -1:
+    if _unpack_record(data, pos) is not None:
+      return pos
+    pos = data.find(SYNC, pos + 1)
+  return None
+
+
+class Spool:
+
+  def __init__(self, path, segment_size=SEGMENT_SIZE):
+    self.path = Path(path).expanduser()
+    self.path.mkdir(parents=True, exist_ok=True)
+    self.segment_size = segment_size
+    self._ack_file = self.path.joinpath('ack')
+
+  def _lock(self):
+    return file_lock(self.path.joinpath('lock'))
+
+  def _segments(self):
+    return sorted(int(seg.stem) for seg in self.path.glob('*.seg'))
+
+  def _segment(self, segno):
+    return self.path.joinpath(f'{segno:08d}.seg')
+
+  def append(self, entry):
+    """Append an entry (a JSON serializable object) to the spool"""
+    payload = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+    data = RECORD.pack(SYNC, len(payload), zlib.crc32(payload)) + payload
+    with self._lock():
+      segments = self._segments()
+      segno = segments[-1] if segments else 0
+      segment = self._segment(segno)
+      if segment.exists() and segment.stat().st_size + len(data) > self.segment_size:
+        segment = self._segment(segno + 1)
+      fdo = os.open(segment, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+      try:
+        os.write(fdo, data)
+        os.fsync(fdo)
+      finally:
+        os.close(fdo)
+
+  def position(self):
+    """Return the position (segment, offset) of the last acknowledged entry"""
+    try:
+      segno, offset = self._ack_file.read_text(encoding='utf-8').split()
+      return int(segno), int(offset)
+    except (FileNotFoundError, ValueError):
+      return -1, 0
+
+  def read(self, count):
+    """Return up to `count` pending entries as a list of (position, entry)"""
+    entries = []
+    ack_segno, ack_offset = self.position()
+    # Appends are written under the lock, an incomplete record is a torn record
+    with self._lock():
+      segments = self._segments()
+      for segno in segments:
+        if segno < ack_segno:
+          continue
+        offset = ack_offset if segno == ack_segno else 0
+        data = self._segment(segno).read_bytes()
+        while len(entries) < count and offset < len(data):
+          record = _unpack_record(data, offset)
+          if record is not None:
+            offset, entry = record
+            entries.append(((segno, offset), entry))
+            continue
+          valid = _resync(data, offset)
+          if valid is not None:
+            logging.error('Spool segment %d corrupted at offset %d, %d bytes skipped',
+                          segno, offset, valid - offset)
+            offset = valid
+          elif segno == segments[-1]:
+            logging.error('Spool segment %d torn at offset %d, truncated', segno, offset)
+            os.truncate(self._segment(segno), offset)
+            break
+          else:
+            logging.error('Spool segment %d corrupted at offset %d, %d bytes skipped',
+                          segno, offset, len(data) - offset)
+            break
+        if len(entries) >= count:
+          break
+    return entries
+
+  def ack(self, position):
+    """Mark every entry up to `position` as delivered"""
+    segno, offset = position
+    tmp_file = self._ack_file.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as fda:
+      fda.write(f'{segno:d} {offset:d}\n')
+      fda.flush()
+      os.fsync(fda.fileno())
+    os.replace(tmp_file, self._ack_file)
+    with self._lock():
+      segments = self._segments()
+      for old in segments[:-1]:
+        if old < segno:
+          self._segment(old).unlink()
+
+  def quarantine(self, entry, reason):
+    """Set aside an entry that cannot be delivered"""
+    line = json.dumps({'reason': str(reason), 'entry': entry}) + '\n'
+    with self._lock(), open(self.path.joinpath(QUARANTINE), 'a', encoding='utf-8') as fdq:
+      fdq.write(line)
+
+  def pending(self):
+    """Number of bytes waiting to be delivered"""
+    ack_segno, ack_offset = self.position()
+    total = 0
+    for segno in self._segments():
+      if segno < ack_segno:
+        continue
+      total += self._segment(segno).stat().st_size
+      if segno == ack_segno:
+        total -= ack_offset
+    return total
+
+
+class Drainer(threading.Thread):
+  """Deliver the spooled entries in the background.
+
+  The `deliver` function receives a list of entries and raises OSError when
+  the delivery fails. Failed batches are retried with an exponential backoff.
+  Delivery is at-least-once, a batch that partially failed is sent again.
+  When `deliver` raises any other exception, the entries of the batch are
+  delivered one by one and the failing entries are quarantined.
+  """
+
+  def __init__(self, spool, deliver, batch_size=32, interval=1.0, max_backoff=300.0):
+    # pylint: disable=too-many-arguments
+    super().__init__(daemon=True)
+    self.spool = spool
+    self.deliver = deliver
+    self.batch_size = batch_size
+    self.interval = interval
+    self.max_backoff = max_backoff
+    self._done = threading.Event()
+
+  def stop(self):
+    self._done.set()
+
+  def drain(self):
+    """Deliver one batch. Return the number of entries delivered"""
+    batch = self.spool.read(self.batch_size)
+    if not batch:
+      return 0
+    try:
+      self.deliver([entry for _, entry in batch])
+    except OSError:
+      raise
+    except Exception as err:  # pylint: disable=broad-exception-caught
+      logging.warning('Batch delivery failed: %r, delivering the entries one by one', err)
+      return self._drain_each(batch)
+    self.spool.ack(batch[-1][0])
+    return len(batch)
+
+  def _drain_each(self, batch):
+    for position, entry in batch:
+      try:
+        self.deliver([entry])
+      except OSError:
+        raise
+      except Exception as err:  # pylint: disable=broad-exception-caught
+        logging.error('Spooled entry quarantined: %r', err)
+        self.spool.quarantine(entry, repr(err))
+      self.spool.ack(position)
+    return len(batch)
+
+  def run(self):
+    backoff = self.interval
+    while not self._done.is_set():
+      try:
+        count = self.drain()
+      except Exception as err:  # pylint: disable=broad-exception-caught
+        if isinstance(err, OSError):
+          logging.warning('Delivery failed: %s, retrying in %.1f seconds', err, backoff)
+        else:
+          logging.exception('Spool error, retrying in %.1f seconds', backoff)
+        self._done.wait(backoff)
+        backoff = min(backoff * 2, self.max_backoff)
+        continue
+      backoff = self.interval
+      if count:
+        logging.info('%d spooled contact(s) delivered', count)
+      else:
+        self._done.wait(self.interval)
@@ -0,0 +1,210 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Logbook statistics updated incrementally.
+
+The aggregates are kept in a sidecar file next to the ADIF log, with the
+offset of the last record processed. Each run only parses the records
+appended since the previous run. The archives made by the log rotation
+are counted once, the records archived since the previous run are read
+from the archive before starting over with the new log file. The number
+of unique calls is estimated with a HyperLogLog sketch.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+from collections import Counter
+from pathlib import Path
+
+from fllog import adifio, archive, dxcc
+
+HLL_PRECISION = 12
+SIDECAR_VERSION = 2            # The dxcc counter is keyed by entity name
+
+
+class HyperLogLog:
+
+  def __init__(self, registers=None, precision=HLL_PRECISION):
+    self.precision = precision
+    self.size = 1 << precision
+    self.registers = bytearray(registers or self.size)
+
+  def add(self, value):
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    hashed = int.from_bytes(digest, 'big')
+    idx = hashed >> (64 - self.precision)
+    rest = hashed & ((1 << (64 - self.precision)) - 1)
+    rank = (64 - self.precision) - rest.bit_length() + 1
+    if rank > self.registers[idx]:
+      self.registers[idx] = rank
+
+  def __len__(self):
+    alpha = 0.7213 / (1 + 1.079 / self.size)
+    estimate = alpha * self.size ** 2 / sum(2.0 ** -r for r in self.registers)
+    zeros = self.registers.count(0)
+    if estimate <= 2.5 * self.size and zeros:
+      estimate = self.size * math.log(self.size / zeros)
+    return round(estimate)
+
+  def dumps(self):
+    return base64.b64encode(bytes(self.registers)).decode('ascii')
+
+  @classmethod
+  def loads(cls, data):
+    return cls(base64.b64decode(data))
+
+
+class LogStats:
+  """Statistics of the ADIF log `logfile`, kept in `logfile`.stats"""
+  # pylint: disable=too-many-instance-attributes
+
+  def __init__(self, logfile, sidecar=None):
+    self.logfile = Path(logfile).expanduser()
+    self.sidecar = Path(sidecar) if sidecar else self.logfile.with_name(
+      self.logfile.name + '.stats')
+    self.resolver = dxcc.default_resolver()
+    self.reset()
+    self.load()
+
+  def reset(self):
+    self.inode = None
+    self.offset = 0
+    self.total = 0
+    self.first = None
+    self.last = None
+    self.counters = {name: Counter() for name in ('band', 'mode', 'day', 'dxcc')}
+    self.calls = HyperLogLog()
+    self.archived = []
+
+  def load(self):
+    try:
+      with open(self.sidecar, 'r', encoding='utf-8') as fds:
+        data = json.load(fds)
+    except FileNotFoundError:
+      return
+    except ValueError as err:
+      logging.warning('%s: %s, rebuilding the statistics', self.sidecar, err)
+      return
+    if data.get('version') != SIDECAR_VERSION:
+      logging.info('%s: old format, rebuilding the statistics', self.sidecar)
+      return
+    self.inode = data['inode']
+    self.offset = data['offset']
+    self.total = data['total']
+    self.first = data['first']
+    self.last = data['last']
+    self.counters = {name: Counter(val) for name, val in data['counters'].items()}
+    self.calls = HyperLogLog.loads(data['calls'])
+    self.archived = data.get('archived', [])
+
+  def save(self):
+    data = {
+      'version': SIDECAR_VERSION,
+      'inode': self.inode,
+      'offset': self.offset,
+      'total': self.total,
+      'first': self.first,
+      'last': self.last,
+      'counters': self.counters,
+      'calls': self.calls.dumps(),
+      'archived': self.archived,
+    }
+    tmp_file = self.sidecar.with_suffix('.tmp')
+    with open(tmp_file, 'w', encoding='utf-8') as fds:
+      json.dump(data, fds)
+    os.replace(tmp_file, self.sidecar)
+
+  def add(self, record):
+    self.total += 1
+    qso_time = record.get('qso_date', '') + record.get('time_on', '').ljust(6, '0')
+    if self.first is None or qso_time < self.first:
+      self.first = qso_time
+    if self.last is None or qso_time > self.last:
+      self.last = qso_time
+    self.counters['band'][record.get('band', '').lower()] += 1
+    self.counters['mode'][record.get('mode', '').upper()] += 1
+    self.counters['day'][record.get('qso_date', '')] += 1
+    self.counters['dxcc'][self._country(record)] += 1
+    self.calls.add(record.get('call', '').upper())
+
+  def _update_archives(self):
+    """Process the archives made since the last update, the one made from
+    the log file being read from the last offset. Return the number of
+    records and of archives processed."""
+    count = 0
+    processed = 0
+    for rotated in archive.archives(self.logfile):
+      if rotated.filename.name in self.archived:
+        continue
+      self.archived.append(rotated.filename.name)
+      offset = self.offset if rotated.inode == self.inode else 0
+      data = rotated.read_from(offset)
+      if not offset:
+        data = data[adifio.data_start(data):]
+      for record in adifio.parse_records(data.decode('utf-8', 'replace')):
+        self.add(record)
+        count += 1
+      processed += 1
+    if processed:
+      self.inode, self.offset = None, 0
+    return count, processed
+
+  def _country(self, record):
+    """Name of the DXCC entity. The country file names come first so an
+    entity is counted under one name, the ADIF numeric dxcc code is only
+    used when the entity has no name."""
+    if self.resolver is not None and record.get('call'):
+      entity = self.resolver.resolve(record['call'].upper())
+      if entity:
+        return entity.entity
+    if record.get('country'):
+      return record['country']
+    return f"DXCC {record['dxcc']}" if record.get('dxcc') else ''
+
+  def update(self):
+    """Process the records added since the last update. Return their number"""
+    with archive.log_lock(self.logfile):
+      count, rotated = self._update_archives()
+      if self.logfile.exists():
+        count += self._update_log(rotated)
+    self.save()
+    return count
+
+  def _update_log(self, rotated):
+    count = 0
+    with open(self.logfile, 'rb') as fdl:
+      stat = os.fstat(fdl.fileno())
+      if not rotated and (stat.st_ino != self.inode or stat.st_size < self.offset):
+        if self.inode is not None:
+          logging.warning('%s has been replaced, rebuilding the statistics', self.logfile)
+          self.reset()
+          count, _ = self._update_archives()
+      self.inode = stat.st_ino
+      if stat.st_size == self.offset:
+        return count
+      with mmap.mmap(fdl.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        start = self.offset or adifio.data_start(buffer)
+        self.offset = adifio.last_record_end(buffer, start)
+        for rstart, rstop in adifio.split_records(buffer, start=start, end=self.offset):
+          for record in adifio.parse_records(buffer[rstart:rstop].decode('utf-8', 'replace')):
+            self.add(record)
+            count += 1
+    return count
+
+  def report(self):
+    return {
+      'total': self.total,
+      'unique_calls': len(self.calls),
+      'first': self.first,
+      'last': self.last,
+      **{name: dict(counter.most_common()) for name, counter in self.counters.items()},
+    }
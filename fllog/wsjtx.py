@@ -17,17 +17,28 @@
 # ******************************************************************
 #
 # pylint: disable=consider-using-f-string,too-few-public-methods,too-many-public-methods
+# pylint: disable=too-many-lines
 
 import ctypes
+import hashlib
 import struct
-from datetime import datetime, timedelta
+from collections import Counter
+from datetime import datetime
 from enum import Enum
 
+from fllog import metrics, wstime
+from fllog.ft8msg import parse_message
+from fllog.wstime import (TimeSpec, datetime2wstime, from_julian, to_julian,
+                          wstime2datetime)
+
 WS_MAGIC = 0xADBCCBDA
 WS_SCHEMA = 2
 WS_VERSION = '1.1'
 WS_REVISION = '1a'
 WS_CLIENTID = 'AUTOFS'
+QTZ_OFFSET = 'OffsetFromUtc'      # QTimeZone marker of the fixed offset zones
+QCOLOR_INVALID = 0                # QColor specs
+QCOLOR_RGB = 1
 
 
 class Mode(Enum):
@@ -83,7 +94,8 @@ class SOMode(Enum):
 
 
 SHEAD = struct.Struct('!III')
-JULIAN_ORIGIN = 2451545         # Julian date for 2000/01/01
+INT32 = struct.Struct('!i')
+JULIAN_ORIGIN = wstime.JULIAN_ORIGIN
 
 
 class _WSPacket:
@@ -125,6 +137,19 @@ class _WSPacket:
     self._index += SHEAD.size
     self._set_string(self._client_id)
 
+  @property
+  def client_id(self):
+    return self._client_id
+
+  @client_id.setter
+  def client_id(self, client_id):
+    assert isinstance(client_id, str), 'The client id must be a string'
+    self._client_id = client_id
+
+  def as_dict(self):
+    """Return the decoded fields"""
+    return dict(self._data)
+
   def __repr__(self):
     sbuf = [str(self.__class__)]
     for key, val in sorted(self._data.items()):
@@ -154,13 +179,62 @@ class _WSPacket:
     struct.pack_into(fmt, self._packet, self._index, length, string)
     self._index += struct.calcsize(fmt)
 
+  def _get_qstring(self):
+    # QString are serialized in UTF-16
+    length = self._get_int32()
+    if length == -1:
+      return None
+    string = self._packet[self._index:self._index + length]
+    self._index += length
+    return string.decode('utf-16-be')
+
+  def _set_qstring(self, string):
+    if string is None:
+      self._set_int32(-1)
+      return
+    string = string.encode('utf-16-be')
+    fmt = '!i{:d}s'.format(len(string))
+    struct.pack_into(fmt, self._packet, self._index, len(string), string)
+    self._index += struct.calcsize(fmt)
+
+  def _get_timezone(self):
+    # QTimeZone is serialized as its IANA id. The zones at a fixed offset
+    # from UTC are serialized as the marker OffsetFromUtc, followed by
+    # their id, offset, name, abbreviation, country and comment.
+    tz_id = self._get_qstring()
+    if tz_id != QTZ_OFFSET:
+      return tz_id
+    self._get_qstring()
+    offset = self._get_int32()
+    self._get_qstring()
+    self._get_qstring()
+    self._get_int32()
+    self._get_qstring()
+    return offset
+
+  def _set_timezone(self, value):
+    if not isinstance(value, int):
+      self._set_qstring(value)
+      return
+    hours, minutes = divmod(abs(value) // 60, 60)
+    tz_id = f"UTC{'-' if value < 0 else '+'}{hours:02d}:{minutes:02d}"
+    self._set_qstring(QTZ_OFFSET)
+    self._set_qstring(tz_id)
+    self._set_int32(value)
+    self._set_qstring(tz_id)
+    self._set_qstring(tz_id)
+    self._set_int32(0)
+    self._set_qstring('')
+
   def _get_datetime(self):
     time_offset = 0
     date_off = self._get_longlong()
     time_off = self._get_uint32()
     time_spec = self._get_byte()
-    if time_spec == 2:
+    if time_spec == TimeSpec.OffsetFromUTC:
       time_offset = self._get_int32()
+    elif time_spec == TimeSpec.TimeZone:
+      time_offset = self._get_timezone()
     return (date_off, time_off, time_spec, time_offset)
 
   def _set_datetime(self, value):
@@ -168,8 +242,10 @@ class _WSPacket:
     self._set_longlong(date_off)
     self._set_uint32(time_off)
     self._set_byte(time_spec)
-    if time_spec == 2:
-      self._set_uint32(time_offset)
+    if time_spec == TimeSpec.OffsetFromUTC:
+      self._set_int32(time_offset)
+    elif time_spec == TimeSpec.TimeZone:
+      self._set_timezone(time_offset)
 
   def _get_data(self, fmt):
     data, *_ = struct.unpack_from(fmt, self._packet, self._index)
@@ -206,6 +282,20 @@ class _WSPacket:
     assert isinstance(value, int)
     self._set_data('!H', value)
 
+  def _set_qcolor(self, rgb):
+    # QColor: spec, alpha, red, green, blue, pad. The components are 16 bits,
+    # an invalid colour (None) removes the highlight in WSJT-X.
+    if rgb is None:
+      self._set_data('!b', QCOLOR_INVALID)
+      for _ in range(5):
+        self._set_uint16(0)
+      return
+    self._set_data('!b', QCOLOR_RGB)
+    self._set_uint16(0xffff)
+    for val in rgb:
+      self._set_uint16(val)
+    self._set_uint16(0)
+
   def _get_uint32(self):
     return self._get_data('!I')
 
@@ -431,6 +521,10 @@ class WSDecode(_WSPacket):
   def Message(self):
     return self._data['Message']
 
+  @property
+  def ParsedMessage(self):
+    return parse_message(self._data['Message'])
+
   @property
   def LowConfidence(self):
     return self._data['LowConfidence']
@@ -830,6 +924,62 @@ class WSWSPRDecode(_WSPacket):
     super().__init__(pkt)
     self._packet_type = PacketType.WSPRDECODE
 
+  def _decode(self):
+    super()._decode()
+    self._data['New'] = self._get_bool()
+    self._data['Time'] = self._get_uint32()
+    self._data['SNR'] = self._get_int32()
+    self._data['DeltaTime'] = round(self._get_double(), 3)
+    self._data['Frequency'] = self._get_longlong()
+    self._data['Drift'] = self._get_int32()
+    self._data['Callsign'] = self._get_string()
+    self._data['Grid'] = self._get_string()
+    self._data['Power'] = self._get_int32()
+    self._data['OffAir'] = self._get_bool()
+
+  def as_dict(self):
+    return self._data
+
+  @property
+  def New(self):
+    return self._data['New']
+
+  @property
+  def Time(self):
+    return wstime2datetime(self._data['Time'])
+
+  @property
+  def SNR(self):
+    return self._data['SNR']
+
+  @property
+  def DeltaTime(self):
+    return self._data['DeltaTime']
+
+  @property
+  def Frequency(self):
+    return self._data['Frequency']
+
+  @property
+  def Drift(self):
+    return self._data['Drift']
+
+  @property
+  def Callsign(self):
+    return self._data['Callsign']
+
+  @property
+  def Grid(self):
+    return self._data['Grid']
+
+  @property
+  def Power(self):
+    return self._data['Power']
+
+  @property
+  def OffAir(self):
+    return self._data['OffAir']
+
 
 class WSLocation(_WSPacket):
   """Packet Type 11 Location (In)"""
@@ -874,6 +1024,9 @@ class WSHighlightCallsign(_WSPacket):
   Background Color       QColor
   Foreground Color       QColor
   Highlight last         bool
+
+  The colours are (red, green, blue) tuples of 16 bit components, None
+  clears the highlight.
   """
 
   def __init__(self, pkt=None):
@@ -883,15 +1036,8 @@ class WSHighlightCallsign(_WSPacket):
   def _encode(self):
     super()._encode()
     self._set_string(self._data['call'])
-
-    self._set_uint16(0xffff)
-    for val in self._data.get('Foreground', (0xffff, 0xff, 0xff)):
-      self._set_uint16(val)
-
-    self._set_uint16(0xffff)
-    for val in self._data.get('Background', (0, 0, 0)):
-      self._set_uint16(val)
-
+    self._set_qcolor(self._data.get('Background'))
+    self._set_qcolor(self._data.get('Foreground'))
     self._set_bool(self._data.get('HighlightLast', True))
 
   def __repr__(self):
@@ -912,7 +1058,7 @@ class WSHighlightCallsign(_WSPacket):
 
   @Background.setter
   def Background(self, rgb):
-    assert isinstance(rgb, (list, tuple)), "Tuple object expected"
+    assert rgb is None or isinstance(rgb, (list, tuple)), "Tuple object expected"
     self._data['Background'] = rgb
 
   @property
@@ -921,7 +1067,7 @@ class WSHighlightCallsign(_WSPacket):
 
   @Foreground.setter
   def Foreground(self, rgb):
-    assert isinstance(rgb, (list, tuple)), "Tuple object expected"
+    assert rgb is None or isinstance(rgb, (list, tuple)), "Tuple object expected"
     self._data['Foreground'] = rgb
 
   @property
@@ -949,55 +1095,154 @@ class WSConfigure(_WSPacket):
     self._packet_type = PacketType.CONFIGURE
 
 
-def from_julian(jday, msec, *_):
-  # this function doesn't work with dates prior to 2000
-  epoch = datetime(2000, 1, 1)
-  tdelta = timedelta(days=jday - JULIAN_ORIGIN)
-  day = epoch + tdelta
-  dtime = day + timedelta(microseconds=msec * 1000)
-  return dtime
+PACKET_CLASSES = {
+  PacketType.HEARTBEAT.value: WSHeartbeat,
+  PacketType.STATUS.value: WSStatus,
+  PacketType.DECODE.value: WSDecode,
+  PacketType.CLEAR.value: WSClear,
+  PacketType.REPLY.value: WSReply,
+  PacketType.QSOLOGGED.value: WSLogged,
+  PacketType.CLOSE.value: WSClose,
+  PacketType.WSPRDECODE.value: WSWSPRDecode,
+  PacketType.LOGGEDADIF.value: WSADIF,
+  PacketType.HIGHLIGHTCALLSIGN.value: WSHighlightCallsign,
+}
 
 
-def to_julian(dtime):
-  # this function doesn't work with dates prior to 2000
-  epoch = datetime(2000, 1, 1)
-  delta = dtime - epoch
-  jday = delta.days + JULIAN_ORIGIN
-  milliseconds = int(delta.seconds * 1000)
-  return (jday, milliseconds, 1, 0)
+def peek_header(pkt):
+  """Return the packet type without decoding the packet"""
+  magic, _, pkt_type = SHEAD.unpack_from(pkt)
+  if magic != WS_MAGIC:
+    raise IOError('Not a WSJT-X packet')
+  return pkt_type
 
 
-def wstime2datetime(qtm):
-  """wsjtx time containd the number of milliseconds since midnight"""
-  tday_midnight = datetime.combine(datetime.utcnow(), datetime.min.time())
-  return tday_midnight + timedelta(milliseconds=qtm)
+def peek_client_id(pkt):
+  """Return the client id without decoding the packet"""
+  length, = INT32.unpack_from(pkt, SHEAD.size)
+  if length == -1:
+    return None
+  start = SHEAD.size + INT32.size
+  return bytes(pkt[start:start + length]).decode('utf-8', errors='replace')
 
 
-def datetime2wstime(dtime):
-  """wsjtx time containd the number of milliseconds since midnight"""
-  tday_midnight = datetime.combine(datetime.utcnow(), datetime.min.time())
-  return int((dtime - tday_midnight).total_seconds() * 1000)
+def payload_offset(pkt):
+  """Offset of the packet data following the client id"""
+  length, = INT32.unpack_from(pkt, SHEAD.size)
+  return SHEAD.size + INT32.size + max(length, 0)
 
 
-def ft8_decode(pkt):
-  """Look at the packets header and return a class corresponding to the packet"""
-  magic, _, pkt_type = SHEAD.unpack_from(pkt)
-  if magic != WS_MAGIC:
-    raise IOError('Not a WSJT-X packet')
+PACKETS = metrics.Counter('fllog_wsjtx_packets_total', 'WSJT-X packets received', ('type',))
+DECODE_ERRORS = metrics.Counter('fllog_wsjtx_decode_errors_total',
+                                'WSJT-X packets that could not be decoded', ('type',))
+DROPPED = metrics.Counter('fllog_wsjtx_packets_dropped_total',
+                          'WSJT-X packets dropped without decoding', ('type',))
+# The children are looked up once, incrementing them is all the decoding pays
+_PACKETS = {t.value: PACKETS.labels(t.name) for t in PacketType}
+_DECODE_ERRORS = {t.value: DECODE_ERRORS.labels(t.name) for t in PacketType}
+_DROPPED = {t.value: DROPPED.labels(t.name) for t in PacketType}
+_UNKNOWN_PACKETS = PACKETS.labels('UNKNOWN')
+_UNKNOWN_ERRORS = DECODE_ERRORS.labels('UNKNOWN')
+_UNKNOWN_DROPPED = DROPPED.labels('UNKNOWN')
+
 
-  switch_map = {
-    PacketType.HEARTBEAT.value: WSHeartbeat,
-    PacketType.STATUS.value: WSStatus,
-    PacketType.DECODE.value: WSDecode,
-    PacketType.CLEAR.value: WSClear,
-    PacketType.REPLY.value: WSReply,
-    PacketType.QSOLOGGED.value: WSLogged,
-    PacketType.CLOSE.value: WSClose,
-    PacketType.LOGGEDADIF.value: WSADIF,
-    PacketType.HIGHLIGHTCALLSIGN.value: WSHighlightCallsign,
-  }
+def count_packet(pkt_type):
+  """Count a packet received, whether it is decoded, dropped or filtered"""
+  _PACKETS.get(pkt_type, _UNKNOWN_PACKETS).inc()
 
+
+def _decode_packet(pkt_type, pkt):
   try:
-    return switch_map[pkt_type](pkt)
+    packet_class = PACKET_CLASSES[pkt_type]
   except KeyError:
+    _DECODE_ERRORS.get(pkt_type, _UNKNOWN_ERRORS).inc()
     raise NotImplementedError("Packet type '{:d}' unknown".format(pkt_type)) from None
+  try:
+    return packet_class(pkt)
+  except (struct.error, UnicodeDecodeError, ValueError):
+    _DECODE_ERRORS[pkt_type].inc()
+    raise
+
+
+def ft8_decode(pkt):
+  """Look at the packets header and return a class corresponding to the packet"""
+  pkt_type = peek_header(pkt)
+  count_packet(pkt_type)
+  return _decode_packet(pkt_type, pkt)
+
+
+def _type_name(pkt_type):
+  try:
+    return PacketType(pkt_type).name
+  except ValueError:
+    return str(pkt_type)
+
+
+class Decoder:
+  """Only decode the packet types subscribed to, and optionally only the
+  packets coming from some clients. The other packets are dropped after
+  reading the header, the number of packets dropped is kept per type.
+
+  >>> decoder = Decoder(PacketType.QSOLOGGED, PacketType.LOGGEDADIF)
+  >>> packet = decoder.decode(data)   # None if the packet is dropped
+  """
+
+  def __init__(self, *types, clients=None):
+    self.types = set()
+    self.clients = set(clients) if clients else None
+    self.dropped = Counter()
+    self.subscribe(*types)
+
+  def subscribe(self, *types):
+    self.types.update(PacketType(t).value for t in types)
+
+  def unsubscribe(self, *types):
+    self.types.difference_update(PacketType(t).value for t in types)
+
+  def decode(self, pkt):
+    pkt_type = peek_header(pkt)
+    count_packet(pkt_type)
+    if pkt_type not in self.types or (self.clients is not None
+                                      and peek_client_id(pkt) not in self.clients):
+      self.dropped[pkt_type] += 1
+      _DROPPED.get(pkt_type, _UNKNOWN_DROPPED).inc()
+      return None
+    return _decode_packet(pkt_type, pkt)
+
+  def stats(self):
+    """Number of packets dropped per packet type, the unknown types by number"""
+    return {_type_name(k): v for k, v in self.dropped.items()}
+
+
+class StatusFilter:
+  """WSJT-X sends a status packet on every change in its window, most of
+  them identical to the previous one. The filter hashes the raw packet
+  following the client id and only decodes the statuses that changed.
+
+  >>> status_filter = StatusFilter()
+  >>> result = status_filter.check(data)  # None if the status didn't change
+  >>> status, delta = result              # delta: the fields that changed
+  """
+
+  def __init__(self):
+    self._last = {}
+    self.unchanged = 0
+    self.changed = 0
+
+  def check(self, pkt):
+    client = peek_client_id(pkt)
+    digest = hashlib.blake2b(pkt[payload_offset(pkt):], digest_size=16).digest()
+    last_digest, last_fields = self._last.get(client, (None, {}))
+    if digest == last_digest:
+      self.unchanged += 1
+      return None
+    self.changed += 1
+    status = WSStatus(pkt)
+    fields = status.as_dict()
+    delta = {k: v for k, v in fields.items() if k not in last_fields or last_fields[k] != v}
+    self._last[client] = (digest, fields)
+    return status, delta
+
+  def forget(self, client_id):
+    """Forget the last status of a client, when it closes"""
+    self._last.pop(client_id, None)
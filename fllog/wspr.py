@@ -0,0 +1,121 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Compact column store for the WSPR spots received from WSJT-X.
+
+A `SpotBatch` keeps the spots in typed arrays, the call signs, grids and
+client ids are interned in a string table. The `SpotCollector` fills a
+batch and hands it to a callback once it reaches its capacity, which
+keeps the memory used bounded whatever the number of spots received.
+"""
+
+from array import array
+
+from fllog import wsjtx
+from fllog.wstime import wstime2epoch
+
+# Column name and array type code
+COLUMNS = {
+  'client': 'H',
+  'time': 'd',
+  'snr': 'b',
+  'delta_time': 'f',
+  'frequency': 'Q',
+  'drift': 'b',
+  'callsign': 'I',
+  'grid': 'I',
+  'power': 'b',
+  'off_air': 'B',
+}
+STRING_COLUMNS = ('client', 'callsign', 'grid')
+
+
+class SpotBatch:
+
+  def __init__(self, capacity=65536):
+    self.capacity = capacity
+    self._index = {}
+    self.strings = []
+    self.columns = {name: array(code) for name, code in COLUMNS.items()}
+
+  def __len__(self):
+    return len(self.columns['time'])
+
+  def __getitem__(self, name):
+    return self.columns[name]
+
+  def full(self):
+    return len(self) >= self.capacity
+
+  def clear(self):
+    self._index.clear()
+    self.strings.clear()
+    for name, code in COLUMNS.items():
+      self.columns[name] = array(code)
+
+  def _intern(self, string):
+    try:
+      return self._index[string]
+    except KeyError:
+      self._index[string] = idx = len(self.strings)
+      self.strings.append(string)
+      return idx
+
+  def append(self, spot):
+    """Add a WSWSPRDecode packet to the batch"""
+    data = spot.as_dict()
+    cols = self.columns
+    cols['client'].append(self._intern(spot.client_id))
+    cols['time'].append(wstime2epoch(data['Time']))
+    cols['snr'].append(data['SNR'])
+    cols['delta_time'].append(data['DeltaTime'])
+    cols['frequency'].append(data['Frequency'])
+    cols['drift'].append(data['Drift'])
+    cols['callsign'].append(self._intern(data['Callsign']))
+    cols['grid'].append(self._intern(data['Grid']))
+    cols['power'].append(data['Power'])
+    cols['off_air'].append(data['OffAir'])
+
+  def rows(self):
+    """Iterate over the spots as dictionaries"""
+    strings = self.strings
+    for row in zip(*self.columns.values()):
+      spot = dict(zip(COLUMNS, row))
+      for name in STRING_COLUMNS:
+        spot[name] = strings[spot[name]]
+      spot['off_air'] = bool(spot['off_air'])
+      yield spot
+
+  def nbytes(self):
+    return sum(col.itemsize * len(col) for col in self.columns.values())
+
+
+class SpotCollector:
+  """Collect the WSPR spots from raw WSJT-X packets.
+  `flush` is called with a full SpotBatch, the batch is cleared afterward."""
+
+  def __init__(self, flush, capacity=65536):
+    self.flush = flush
+    self.batch = SpotBatch(capacity)
+    self.count = 0
+
+  def ingest(self, pkt):
+    """Add the spot if `pkt` is a WSPR decode. Return True if the packet was used"""
+    _, _, pkt_type = wsjtx.SHEAD.unpack_from(pkt)
+    if pkt_type != wsjtx.PacketType.WSPRDECODE.value:
+      return False
+    self.batch.append(wsjtx.WSWSPRDecode(pkt))
+    self.count += 1
+    if self.batch.full():
+      self.close()
+    return True
+
+  def close(self):
+    """Flush the spots left in the batch"""
+    if len(self.batch):
+      self.flush(self.batch)
+      self.batch.clear()
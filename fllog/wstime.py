@@ -0,0 +1,162 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+"""
+Time codec for the WSJT-X QTime and QDateTime fields.
+
+QTime is the number of milliseconds since midnight. QDateTime is a
+Julian day number, the milliseconds since midnight, a time spec and,
+depending on the time spec, an offset or a time zone. All the datetime
+objects returned are naive and in UTC.
+"""
+# pylint: disable=invalid-name
+
+import logging
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from enum import IntEnum
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+JULIAN_ORIGIN = 2451545         # Julian date for 2000/01/01
+JULIAN_EPOCH = 2440588          # Julian date for 1970/01/01
+JULIAN_ORDINAL = 1721425        # Julian date - proleptic Gregorian ordinal
+MSEC_PER_DAY = 86_400_000
+EPOCH = datetime(1970, 1, 1)
+
+UTC_OFFSET = re.compile(r'^UTC(?P<sign>[+-])(?P<hours>\d{1,2})(?::?(?P<minutes>\d{2}))?$')
+
+
+class TimeSpec(IntEnum):
+  LocalTime = 0
+  UTC = 1
+  OffsetFromUTC = 2
+  TimeZone = 3
+
+
+class _Midnight:
+  """Cache the current UTC midnight, recomputed when the day rolls over"""
+  # pylint: disable=too-few-public-methods
+
+  def __init__(self):
+    self._midnight = EPOCH
+    self._start = 0
+    self._end = 0
+
+  def _update(self):
+    now = time.time()
+    if now >= self._end:
+      days = int(now // 86400)
+      self._start = days * 86400
+      self._end = self._start + 86400
+      self._midnight = EPOCH + timedelta(days=days)
+    return int((now - self._start) * 1000)
+
+  def now(self):
+    """Return the midnight datetime and the milliseconds elapsed since midnight"""
+    elapsed = self._update()
+    return self._midnight, elapsed
+
+  def epoch(self):
+    """Return the midnight epoch and the milliseconds elapsed since midnight"""
+    elapsed = self._update()
+    return self._start, elapsed
+
+
+_midnight = _Midnight()
+
+
+def wstime2datetime(qtm):
+  """wsjtx time contains the number of milliseconds since midnight.
+  A time more than 12 hours ahead of now was sent before midnight."""
+  midnight, elapsed = _midnight.now()
+  if qtm - elapsed > MSEC_PER_DAY // 2:
+    qtm -= MSEC_PER_DAY
+  return midnight + timedelta(milliseconds=qtm)
+
+
+def wstime2epoch(qtm):
+  """Same as wstime2datetime, but returns the seconds since the epoch"""
+  start, elapsed = _midnight.epoch()
+  if qtm - elapsed > MSEC_PER_DAY // 2:
+    qtm -= MSEC_PER_DAY
+  return start + qtm / 1000
+
+
+def datetime2wstime(dtime):
+  """wsjtx time contains the number of milliseconds since midnight"""
+  if dtime.tzinfo is not None:
+    dtime = dtime.astimezone(timezone.utc)
+  return ((dtime.hour * 60 + dtime.minute) * 60 + dtime.second) * 1000 + dtime.microsecond // 1000
+
+
+@lru_cache(maxsize=64)
+def time_zone(name):
+  """Return the tzinfo of a Qt time zone id. The ids that are not IANA
+  names, like UTC+02:00, are fixed offsets. Unknown and null ids are UTC."""
+  try:
+    return ZoneInfo(name)
+  except (ZoneInfoNotFoundError, TypeError, ValueError):
+    pass
+  match = UTC_OFFSET.match(name or '')
+  if match is None:
+    logging.debug('Unknown time zone %r, using UTC', name)
+    return timezone.utc
+  offset = timedelta(hours=int(match['hours']), minutes=int(match['minutes'] or 0))
+  return timezone(-offset if match['sign'] == '-' else offset)
+
+
+def from_julian(jday, msec, time_spec=TimeSpec.UTC, offset=0):
+  """Convert a QDateTime into a naive UTC datetime. For the TimeZone time
+  spec the offset is the time zone id, or the offset in seconds of the
+  zones at a fixed offset from UTC."""
+  try:
+    dtime = EPOCH + timedelta(milliseconds=(jday - JULIAN_EPOCH) * MSEC_PER_DAY + msec)
+  except OverflowError:
+    return None                 # Null or invalid QDate
+
+  if time_spec == TimeSpec.UTC:
+    return dtime
+  if time_spec == TimeSpec.OffsetFromUTC:
+    return dtime - timedelta(seconds=offset)
+  if time_spec == TimeSpec.TimeZone:
+    if isinstance(offset, int):
+      return dtime - timedelta(seconds=offset)
+    dtime = dtime.replace(tzinfo=time_zone(offset))
+  return dtime.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_julian(dtime):
+  """Convert a datetime into a UTC QDateTime tuple. Naive datetimes are in UTC"""
+  if dtime.tzinfo is not None:
+    dtime = dtime.astimezone(timezone.utc)
+  return (dtime.toordinal() + JULIAN_ORDINAL, datetime2wstime(dtime), TimeSpec.UTC.value, 0)
+
+
+def julian_to_epoch(jdays, msecs):
+  """Convert sequences of Julian days and milliseconds since midnight (UTC)
+  into seconds since the epoch. Returns a NumPy array when NumPy is installed."""
+  if np is None:
+    return [(jday - JULIAN_EPOCH) * 86400 + msec / 1000 for jday, msec in zip(jdays, msecs)]
+  jdays = np.asarray(jdays, dtype=np.int64)
+  msecs = np.asarray(msecs, dtype=np.int64)
+  return ((jdays - JULIAN_EPOCH) * MSEC_PER_DAY + msecs) / 1000.0
+
+
+def julian_to_datetime64(jdays, msecs):
+  """Convert sequences of Julian days and milliseconds since midnight (UTC)
+  into a NumPy datetime64[ms] array."""
+  if np is None:
+    raise ImportError('julian_to_datetime64 requires numpy')
+  jdays = np.asarray(jdays, dtype=np.int64)
+  msecs = np.asarray(msecs, dtype=np.int64)
+  return ((jdays - JULIAN_EPOCH) * MSEC_PER_DAY + msecs).astype('datetime64[ms]')
@@ -0,0 +1,83 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+
+import threading
+from datetime import datetime, timezone
+from xmlrpc.server import SimpleXMLRPCServer
+
+import pytest
+
+from fllog import fldigi_rpc
+
+HEADER = 'fldigi logbook\n<EOH>\n'
+
+
+def _record(call, time_on, notes=''):
+  fields = {'call': call, 'qso_date': '20240105', 'time_on': time_on, 'freq': '14.070000',
+            'mode': 'PSK31', 'my_gridsquare': 'CM87vl', 'tx_pwr': '50', 'notes': notes}
+  return ''.join(f'<{k.upper()}:{len(v)}>{v}' for k, v in fields.items()) + '<EOR>\n'
+
+
+@pytest.fixture(name='fldigi')
+def fixture_fldigi():
+  """Stand-in for fldigi's XML-RPC server"""
+  server = SimpleXMLRPCServer(('127.0.0.1', 0), logRequests=False, allow_none=True)
+  server.register_function(lambda: 'BPSK31', 'modem.get_name')
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  yield f'http://127.0.0.1:{server.server_address[1]}'
+  server.shutdown()
+  server.server_close()
+
+
+def test_new_contacts(fldigi, tmp_path):
+  logbook = tmp_path.joinpath('logbook.adif')
+  logbook.write_text(HEADER + _record('K1AA', '1200'), encoding='utf-8')
+  poller = fldigi_rpc.FldigiPoller(fldigi, logbook=logbook)
+  assert not poller.poll()
+  with open(logbook, 'a', encoding='utf-8') as fdl:
+    fdl.write(_record('K2BB', '1210'))
+  records = poller.poll()
+  assert [record['call'] for record in records] == ['K2BB']
+  assert fldigi_rpc.qso_time(records[0]) == datetime(2024, 1, 5, 12, 10, tzinfo=timezone.utc)
+  assert poller.environment(records[0]) == {
+    'FLDIGI_LOG_CALL': 'K2BB', 'FLDIGI_MY_LOCATOR': 'CM87vl', 'FLDIGI_LOGBOOK_TX_PWR': '50',
+    'FLDIGI_FREQUENCY': '14070000', 'FLDIGI_MODEM_ADIF_NAME': 'PSK31',
+    'FLDIGI_MODEM_LONG_NAME': 'BPSK31',
+  }
+
+
+def test_rewrite_not_logged(fldigi, tmp_path):
+  logbook = tmp_path.joinpath('logbook.adif')
+  logbook.write_text(HEADER + _record('K1AA', '1200') + _record('K2BB', '1210'),
+                     encoding='utf-8')
+  poller = fldigi_rpc.FldigiPoller(fldigi, logbook=logbook)
+  # An old contact edited, the logbook is rewritten larger
+  logbook.write_text(HEADER + _record('K1AA', '1200', 'a longer note')
+                     + _record('K2BB', '1210'), encoding='utf-8')
+  assert not poller.poll()
+  with open(logbook, 'a', encoding='utf-8') as fdl:
+    fdl.write(_record('K3CC', '1220'))
+  assert [record['call'] for record in poller.poll()] == ['K3CC']
+
+
+def test_run_callback_errors(fldigi, tmp_path):
+  logbook = tmp_path.joinpath('logbook.adif')
+  logbook.write_text(HEADER, encoding='utf-8')
+  poller = fldigi_rpc.FldigiPoller(fldigi, interval=0.01, logbook=logbook)
+  with open(logbook, 'a', encoding='utf-8') as fdl:
+    fdl.write(_record('K1AA', '1200') + _record('K2BB', '1210'))
+  logged = []
+
+  def callback(env, when):
+    logged.append((env['FLDIGI_LOG_CALL'], when.strftime('%H%M')))
+    if len(logged) == 1:
+      raise ValueError('callback error')
+    poller.stop()
+
+  poller.run(callback)
+  assert logged == [('K1AA', '1200'), ('K2BB', '1210')]
@@ -0,0 +1,91 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+
+import os
+import struct
+from multiprocessing import shared_memory
+
+import pytest
+
+from fllog import shmfeed, wsjtx
+
+
+def _string(value):
+  data = value.encode('utf-8')
+  return struct.pack('!i', len(data)) + data
+
+
+def _decode(message, snr=-10):
+  """Raw WSJT-X decode packet"""
+  return b''.join((
+    wsjtx.SHEAD.pack(wsjtx.WS_MAGIC, wsjtx.WS_SCHEMA, wsjtx.PacketType.DECODE.value),
+    _string('WSJT-X'), struct.pack('!?IidI', True, 45015000, snr, 0.2, 1234),
+    _string('~'), _string(message), struct.pack('!??', False, False),
+  ))
+
+
+@pytest.fixture(name='feed_name')
+def fixture_feed_name():
+  name = f'fllog-test-{os.getpid()}'
+  yield name
+  try:
+    shared_memory.SharedMemory(name).unlink()
+  except FileNotFoundError:
+    pass
+
+
+def test_publish_read(feed_name):
+  with shmfeed.FeedWriter(feed_name, 8) as writer, \
+       shmfeed.FeedReader(feed_name) as reader:
+    writer.publish(wsjtx.ft8_decode(_decode('CQ K1ABC FN42', snr=-7)), received=100.0)
+    records = reader.read()
+    assert len(records) == 1
+    record = records[0]
+    assert isinstance(record, shmfeed.Decode)
+    assert (record.seq, record.received, record.client_id) == (1, 100.0, 'WSJT-X')
+    assert (record.snr, record.delta_frequency, record.mode) == (-7, 1234, '~')
+    assert record.message == 'CQ K1ABC FN42'
+    assert not reader.read()
+
+
+def test_overrun(feed_name):
+  with shmfeed.FeedWriter(feed_name, 8) as writer, \
+       shmfeed.FeedReader(feed_name) as reader:
+    for num in range(20):
+      writer.publish(wsjtx.ft8_decode(_decode(f'CQ K{num}ABC')))
+    records = reader.read()
+    assert (reader.overruns, reader.lost) == (1, 13)
+    assert [record.seq for record in records] == list(range(14, 21))
+    assert records[-1].message == 'CQ K19ABC'
+
+
+def test_oldest(feed_name):
+  with shmfeed.FeedWriter(feed_name, 8) as writer:
+    for num in range(3):
+      writer.publish(wsjtx.ft8_decode(_decode(f'CQ K{num}ABC')))
+    with shmfeed.FeedReader(feed_name, oldest=True) as reader:
+      assert [record.seq for record in reader.read()] == [1, 2, 3]
+
+
+def test_running_writer_kept(feed_name):
+  with shmfeed.FeedWriter(feed_name, 8) as writer:
+    writer.publish(wsjtx.ft8_decode(_decode('CQ K1ABC')))
+    with pytest.raises(IOError):
+      shmfeed.FeedWriter(feed_name, 8)
+    with shmfeed.FeedReader(feed_name, oldest=True) as reader:
+      assert len(reader.read()) == 1
+
+
+def test_stale_feed_replaced(feed_name):
+  writer = shmfeed.FeedWriter(feed_name, 8)
+  writer.publish(wsjtx.ft8_decode(_decode('CQ K1ABC')))
+  # Left by a process that is gone
+  shmfeed.HEADER.pack_into(writer.shm.buf, 0, shmfeed.MAGIC, 8, shmfeed.SLOT_SIZE, 0x7fffffff,
+                           writer.seq)
+  writer.close(unlink=False)
+  with shmfeed.FeedWriter(feed_name, 8), shmfeed.FeedReader(feed_name, oldest=True) as reader:
+    assert not reader.read()
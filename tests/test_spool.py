@@ -0,0 +1,74 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2023-2024, Fred W6BSD
+# All rights reserved.
+#
+
+import json
+import os
+
+from fllog import spool
+
+
+def _segment(path):
+  return path.joinpath('00000000.seg')
+
+
+def test_append_read_ack(tmp_path):
+  spooled = spool.Spool(tmp_path)
+  for num in range(5):
+    spooled.append({'num': num})
+  batch = spooled.read(3)
+  assert [entry['num'] for _, entry in batch] == [0, 1, 2]
+  spooled.ack(batch[-1][0])
+  assert [entry['num'] for _, entry in spooled.read(10)] == [3, 4]
+
+
+def test_torn_tail_truncated(tmp_path):
+  spooled = spool.Spool(tmp_path)
+  spooled.append({'num': 0})
+  spooled.append({'num': 1})
+  size = _segment(tmp_path).stat().st_size
+  os.truncate(_segment(tmp_path), size - 3)
+  assert [entry['num'] for _, entry in spooled.read(10)] == [0]
+  good_size = _segment(tmp_path).stat().st_size
+  assert good_size < size - 3
+  # The next append follows the last complete record
+  spooled.append({'num': 2})
+  assert [entry['num'] for _, entry in spooled.read(10)] == [0, 2]
+
+
+def test_corrupted_record_skipped(tmp_path):
+  spooled = spool.Spool(tmp_path)
+  for num in range(3):
+    spooled.append({'num': num})
+  data = bytearray(_segment(tmp_path).read_bytes())
+  second = data.index(spool.SYNC, 1)
+  data[second + spool.RECORD.size + 2] ^= 0xff
+  _segment(tmp_path).write_bytes(bytes(data))
+  assert [entry['num'] for _, entry in spooled.read(10)] == [0, 2]
+
+
+def test_garbage_tail_resync(tmp_path):
+  spooled = spool.Spool(tmp_path, segment_size=1 << 24)
+  spooled.append({'num': 0})
+  with open(_segment(tmp_path), 'ab') as fds:
+    fds.write(os.urandom(1 << 20) + spool.SYNC * 1000)
+  spooled.append({'num': 1})
+  assert [entry['num'] for _, entry in spooled.read(10)] == [0, 1]
+
+
+def test_drainer_quarantine(tmp_path):
+  spooled = spool.Spool(tmp_path)
+  for num in range(3):
+    spooled.append({'num': num})
+
+  def deliver(entries):
+    if any(entry['num'] == 1 for entry in entries):
+      raise KeyError('num')
+
+  assert spool.Drainer(spooled, deliver).drain() == 3
+  assert not spooled.read(10)
+  with open(tmp_path.joinpath(spool.QUARANTINE), encoding='utf-8') as fdq:
+    assert [json.loads(line)['entry'] for line in fdq] == [{'num': 1}]
@@ -0,0 +1,98 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+# pylint: disable=protected-access
+
+import struct
+from datetime import datetime
+
+import pytest
+
+from fllog import wsjtx
+from fllog.wstime import TimeSpec, to_julian
+
+QCOLOR = struct.Struct('!bHHHHH')    # spec, alpha, red, green, blue, pad
+
+
+def _logged():
+  packet = wsjtx.WSLogged()
+  packet.client_id = 'WSJT-X'
+  packet.DateTimeOff = datetime(2024, 1, 5, 12, 11, 30)
+  packet.DateTimeOn = datetime(2024, 1, 5, 12, 10, 15)
+  packet.DXCall = 'K1ABC'
+  packet.DXGrid = 'FN42'
+  packet.DialFrequency = 14074000
+  packet.Mode = 'MSK144'
+  packet.ReportSent = '-10'
+  packet.ReportReceived = '-12'
+  packet.TXPower = '50'
+  packet.Comments = 'Test'
+  packet.Name = 'Joe'
+  packet.ExSent = '599 12'
+  packet.ExReceived = '599 34 SCV'
+  return packet
+
+
+def test_logged_roundtrip():
+  packet = _logged()
+  decoded = wsjtx.ft8_decode(packet.raw())
+  assert isinstance(decoded, wsjtx.WSLogged)
+  assert decoded.client_id == 'WSJT-X'
+  assert decoded.as_dict() == {**packet.as_dict(), 'OpCall': '', 'MyCall': '', 'MyGrid': '',
+                               'PropMode': ''}
+  assert decoded.DateTimeOn == datetime(2024, 1, 5, 12, 10, 15)
+  assert decoded.DateTimeOff == datetime(2024, 1, 5, 12, 11, 30)
+
+
+@pytest.mark.parametrize('time_spec, offset, expected', [
+  (TimeSpec.UTC, 0, datetime(2024, 7, 1, 12, 0)),
+  (TimeSpec.OffsetFromUTC, -3600, datetime(2024, 7, 1, 13, 0)),
+  (TimeSpec.TimeZone, 'Europe/Paris', datetime(2024, 7, 1, 10, 0)),
+  (TimeSpec.TimeZone, 19800, datetime(2024, 7, 1, 6, 30)),
+  (TimeSpec.TimeZone, -25200, datetime(2024, 7, 1, 19, 0)),
+])
+def test_datetime_roundtrip(time_spec, offset, expected):
+  jday, msec, _, _ = to_julian(datetime(2024, 7, 1, 12, 0))
+  packet = _logged()
+  packet._data['DateTimeOn'] = (jday, msec, time_spec.value, offset)
+  decoded = wsjtx.ft8_decode(packet.raw())
+  assert decoded._data['DateTimeOn'] == (jday, msec, time_spec.value, offset)
+  assert decoded.DateTimeOn == expected
+  # The fields following the QDateTime are read from the right offset
+  assert decoded.OpCall == '' and decoded.ExReceived == '599 34 SCV'
+
+
+def _colors(packet):
+  raw = packet.raw()
+  offset = wsjtx.payload_offset(raw)
+  offset += 4 + struct.unpack_from('!i', raw, offset)[0]
+  background = QCOLOR.unpack_from(raw, offset)
+  foreground = QCOLOR.unpack_from(raw, offset + QCOLOR.size)
+  highlight_last, = struct.unpack_from('!?', raw, offset + 2 * QCOLOR.size)
+  assert len(raw) == offset + 2 * QCOLOR.size + 1
+  return background, foreground, highlight_last
+
+
+def test_highlight_qcolor():
+  packet = wsjtx.WSHighlightCallsign()
+  packet.call = 'K1ABC'
+  packet.Background = (0xffff, 0, 0x8000)
+  packet.Foreground = (0, 0x1234, 0xffff)
+  packet.HighlightLast = False
+  background, foreground, highlight_last = _colors(packet)
+  assert background == (wsjtx.QCOLOR_RGB, 0xffff, 0xffff, 0, 0x8000, 0)
+  assert foreground == (wsjtx.QCOLOR_RGB, 0xffff, 0, 0x1234, 0xffff, 0)
+  assert highlight_last is False
+
+
+def test_highlight_clear():
+  packet = wsjtx.WSHighlightCallsign()
+  packet.call = 'K1ABC'
+  packet.Background = None
+  packet.Foreground = None
+  background, foreground, highlight_last = _colors(packet)
+  assert background == foreground == (wsjtx.QCOLOR_INVALID, 0, 0, 0, 0, 0)
+  assert highlight_last is True
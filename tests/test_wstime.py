@@ -0,0 +1,59 @@
+#
+# BSD 3-Clause License
+#
+# Copyright (c) 2021-2024, Fred W6BSD
+# All rights reserved.
+#
+
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from fllog import wstime
+from fllog.wstime import TimeSpec
+
+
+@pytest.mark.parametrize('name, expected', [
+  ('Europe/Paris', ZoneInfo('Europe/Paris')),
+  ('UTC+02:00', timezone(timedelta(hours=2))),
+  ('UTC-05:30', timezone(-timedelta(hours=5, minutes=30))),
+  ('UTC+9', timezone(timedelta(hours=9))),
+  ('Not/AZone', timezone.utc),
+  (None, timezone.utc),
+])
+def test_time_zone(name, expected):
+  assert wstime.time_zone(name) == expected
+
+
+@pytest.mark.parametrize('dtime', [
+  datetime(2024, 1, 5, 12, 10, 15, 250000),
+  datetime(1999, 12, 31, 23, 59, 59),
+  datetime(2000, 1, 1),
+])
+def test_julian_roundtrip(dtime):
+  jday, msec, time_spec, offset = wstime.to_julian(dtime)
+  assert time_spec == TimeSpec.UTC
+  assert wstime.from_julian(jday, msec, time_spec, offset) == dtime
+
+
+def test_to_julian_aware():
+  paris = datetime(2024, 7, 1, 14, 0, tzinfo=ZoneInfo('Europe/Paris'))
+  assert wstime.from_julian(*wstime.to_julian(paris)) == datetime(2024, 7, 1, 12, 0)
+
+
+def test_from_julian_null_date():
+  assert wstime.from_julian(0, 0) is None
+
+
+def test_from_julian_local_time():
+  jday, msec, _, _ = wstime.to_julian(datetime(2024, 7, 1, 12, 0))
+  expected = datetime(2024, 7, 1, 12, 0).astimezone(timezone.utc).replace(tzinfo=None)
+  assert wstime.from_julian(jday, msec, TimeSpec.LocalTime, 3600) == expected
+
+
+def test_wstime_roundtrip():
+  now = datetime.now(timezone.utc).replace(tzinfo=None)
+  qtm = wstime.datetime2wstime(now)
+  assert abs(wstime.wstime2datetime(qtm) - now) < timedelta(milliseconds=1)
+  assert abs(wstime.wstime2epoch(qtm) - now.replace(tzinfo=timezone.utc).timestamp()) < 0.001